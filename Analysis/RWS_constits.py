@@ -4,7 +4,6 @@ Store the result to database for later use.
 
 HVEC, march 2022
 """
-print("30_constit_calc commenced")
 # General packages
 import pandas as pd
 import sqlite3 as sq
@@ -12,16 +11,43 @@ import time
 from tqdm import tqdm
 import os
 import logging
-import copy as cp
+import sys
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # Company packages
 import hvec_support.sqlite as hv
 import hvec_tide as tide
 
+# Project modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import RWS_store as store
+import RWS_reader as reader
+import harmonicAnalysis as hx
+import epochTime as et
+import observationCache as oc
+import instrumentation as ins
 
-# Debugging and logging
-logging.basicConfig(filename='RWS_constits.log', encoding='utf-8', level=logging.INFO, filemode = 'w')
-logging.captureWarnings(capture = True)
+
+# Number of worker processes for the tide analysis; 1 runs the serial path
+WORKERS = os.cpu_count()
+
+# Settings of the tide analysis; part of the key of stored results
+SOLVER_OPTIONS = dict(
+    meth_N = 'Bence', lat = 52, nodal = False, trend = False,
+    method = 'robust', conf_int = 'none')
+
+MAXIT = 50  # Iteration limit of the robust fit in utide
+
+# Timing and memory per stage and per unit, as JSON lines; see instrumentation
+TRACE = 'RWS_constits.jsonl'
+
+# Constituent sets analysed
+CNST = {
+    'short': ['M2', 'S2'],
+    'vRijn': ['M2', 'S2', 'N2', 'K2', 'K1', 'O1', 'P1'],
+    'PE': ['M2', 'S2', 'M4', 'SA', 'N2', 'O1', 'MS4']}
 
 
 names = (
@@ -48,63 +74,25 @@ def initialise():
         name, string: location
     """
     global conn_in, conn_out, names
-    
+
+    # Debugging and logging
+    logging.basicConfig(filename='RWS_constits.log', encoding='utf-8', level=logging.INFO, filemode = 'w')
+    logging.captureWarnings(capture = True)
+    ins.enable(TRACE)
+
     tqdm.pandas()
 
     dir = os.getenv("DATAPATH")
     file = 'RWS_data.db'
-    conn_in = hv.connect_verbose(dir + file, detect_types = True)
+    conn_in = hv.connect_verbose(dir + file)
     
+    # Results are kept between runs; see RWS_store
     file = 'RWS_processed.db'
-    try:
-        os.remove(dir + file)
-    except:
-        pass
-    
     conn_out = hv.connect_verbose(dir + file)
+    store.create(conn_out)
     return
     
 
-def read_data(name):
-    """
-    Read observations for analysis
-
-    Args:
-        name, string: location
-    """
-    print('Reading data')
-    sql = (
-        "SELECT naam, tijd, tepoch_dy AS t, waarde/100 AS h, bron "
-        "FROM 'RWS_Waterinfo' "
-        "WHERE (naam IN {} AND grootheid == 'WATHTE' ) ".format(name)
-    #    "AND bron!= 'Historische waterstandsdata. Verkregen van RWS DID ') ".format(name)
-    )
-    df = pd.read_sql(sql, conn_in)
-    df.sort_values(by = 'tijd', inplace = True)
-    df['year'] = df['tijd'].dt.year
-    df = df[df['year'] < 2022]
-    #df = df[df['tijd'].dt.year.isin([2019, 2020, 2021])]
-    conn_in.close()
-    return(df)
-
-
-def patch_ijmuiden():
-    """
-    Station IJmuiden Noordersluis misses data. Differences between
-    Noordersluis and Buitenhaven (also spelled as buitenhaven) are 
-    negligible.
-
-    So creating a station "IJmuiden"
-    """
-    tmp = cp.copy(df[
-        df['naam'].isin(["IJmuiden Noordersluis", "IJmuiden buitenhaven", "IJmuiden Buitenhaven"])
-    ])
-    tmp.drop_duplicates(subset = 'tijd', inplace = True)
-    tmp['naam'] = 'IJmuiden'
-    df2 = df.append(tmp)
-    return df2
-
-
 def analyse_grouped_years(df, constit, step = 2):
     """
     Run tide analysis for multi-year periods
@@ -118,10 +106,10 @@ def analyse_grouped_years(df, constit, step = 2):
         tmp = pd.DataFrame()
         data = df[df['year'].between(yr - step, yr)]  # Take trailing set
         
-        coef = tide.run_utide_solve(data['t'], data['h'], meth_N = 'Bence',
-            constit = constit,
-            lat = 52, nodal = False, trend = False,
-            method = 'robust', conf_int = 'none')
+        with ins.span('solve', naam = df['naam'].iloc[0], year = yr, n = len(data)) as info:
+            coef = tide.run_utide_solve(data['t'], data['h'],
+                constit = constit, **SOLVER_OPTIONS)
+            info.update(solver_info(coef))
 
         if not(isinstance(coef, str)):
             tmp = pd.concat(
@@ -135,6 +123,340 @@ def analyse_grouped_years(df, constit, step = 2):
     return res
 
 
+def analyse_batched(df, constit, step = 2, method = 'robust'):
+    """
+    Run tide analysis for multi-year periods with the batched solver of
+    harmonicAnalysis; the windows of a station in batches. Same columns as
+    analyse_grouped_years.
+
+    Args:
+        df, dataframe: observations of a single station
+        constit, list: constituent names
+        step, int: number of trailing years added to each window
+        method, string: 'ols' or 'robust'
+    """
+    years = df['year'].unique()
+    ends = years[step: len(years) + 1]
+    X = hx.basis(df['t'], constit, tref = df['t'].mean())
+    h = df['h'].to_numpy()
+
+    # Windows overlap for step > 0; rows are copied a batch of windows at a time
+    res = []
+    for i in range(0, len(ends), hx.BATCH):
+        rows = [
+            np.flatnonzero(df['year'].between(yr - step, yr))  # Take trailing set
+            for yr in ends[i: i + hx.BATCH]]
+        idx = np.concatenate(rows)
+        groups = np.repeat(ends[i: i + hx.BATCH], [len(r) for r in rows])
+
+        with ins.span('solve_batched', naam = df['naam'].iloc[0], n = len(idx)):
+            tmp = hx.solve_stacked(X[idx], h[idx], groups, constit, method = method)
+        for yr, it in zip(tmp['group'], tmp.attrs.get('iterations', [])):
+            ins.event(
+                'solver', naam = df['naam'].iloc[0], year = yr, iterations = it,
+                converged = bool(it < hx.MAXIT))
+        res.append(tmp)
+
+    res = pd.concat(res, ignore_index = True)
+    yr = res.pop('group')
+    res['year'] = yr
+    res['year_start'] = yr - step
+    return res
+
+
+def analyse_windows(df, constit, steps = (0, 2), method = 'ols'):
+    """
+    Run tide analysis for several trailing window lengths in one pass, from
+    per-year normal equations (see harmonicAnalysis.solve_windows).
+
+    Args:
+        df, dataframe: observations of a single station
+        constit, list: constituent names
+        steps, iterable: numbers of trailing years added to each window
+        method, string: 'ols' or 'robust' (warm started from least squares)
+    """
+    return hx.solve_windows(
+        df['t'].to_numpy(), df['h'].to_numpy(), df['year'].to_numpy(),
+        constit, steps = steps, method = method)
+
+
+def make_units(df, cnst, step = 2):
+    """
+    Generator splitting the analysis in independent work units; one per
+    constituent set, station and year window. Units are yielded per station
+    (sorted) and year, with the constituent sets of a window sharing its
+    arrays, so only one window is copied at a time; collect restores the
+    order of the serial path.
+
+    Args:
+        df, dataframe: observations of all stations
+        cnst, dict: constituent sets
+        step, int: number of trailing years added to each window
+    """
+    for nm, data in df.groupby('naam'):
+        years = data['year'].unique()
+        for yr in years[step: len(years) + 1]:
+            window = data[data['year'].between(yr - step, yr)]  # Take trailing set
+            t, h = window['t'].to_numpy(), window['h'].to_numpy()
+            for ky in cnst.keys():
+                yield (ky, nm, yr, step, cnst[ky], t, h)
+
+
+def units_from_cache(cache, cnst, step = 2, stations = None):
+    """
+    Generator of work units as in make_units, taken from the memory-mapped
+    observation cache instead of a dataframe; only one window is in memory
+    at a time
+
+    Args:
+        cache, ObservationCache: exported observations
+        cnst, dict: constituent sets
+        step, int: number of trailing years added to each window
+        stations, list: stations to analyse; default all in the cache
+    """
+    for nm in sorted(stations or cache.stations):
+        years = cache.years(nm)
+        years = years[years < 2022]
+        for yr in years[step: len(years) + 1]:
+            with ins.span('read', naam = nm, year = yr):
+                t, h = cache.window(nm, yr - step, yr)
+                t, h = et.epoch_days(t), h.astype(float)
+            for ky in cnst.keys():
+                yield (ky, nm, yr, step, cnst[ky], t, h)
+
+
+def units_from_sql(cnxn, stations, cnst, step = 2):
+    """
+    Generator of work units as in make_units, streamed from the database
+    one station-year at a time (see RWS_reader)
+
+    Args:
+        cnxn, connection: RWS_data.db
+        stations, dict: name: tuple of source station names
+        cnst, dict: constituent sets
+        step, int: number of trailing years added to each window
+    """
+    source = ins.iterate(
+        reader.stream(cnxn, stations, step = step), 'read',
+        labels = lambda item: {'naam': item[0], 'year': item[1]})
+    for nm, yr, data in source:
+        t, h = data['t'].to_numpy(), data['h'].to_numpy()
+        for ky in cnst.keys():
+            yield (ky, nm, yr, step, cnst[ky], t, h)
+
+
+def init_worker():
+    """
+    Route warnings of the worker processes to the log of the main process
+    """
+    logging.basicConfig(filename='RWS_constits.log', encoding='utf-8', level=logging.INFO, filemode = 'a')
+    logging.captureWarnings(capture = True)
+    return
+
+
+def solver_info(coef):
+    """
+    Iterations and convergence of the robust fit of a utide solution; None
+    for failed or non-robust analyses
+    """
+    try:
+        iterations = int(coef['rf']['iterations'])
+    except (TypeError, KeyError, IndexError):
+        return {'iterations': None, 'converged': not isinstance(coef, str)}
+    return {'iterations': iterations, 'converged': iterations < MAXIT}
+
+
+def solve_unit(unit):
+    """
+    Tide analysis of a single work unit, see make_units
+
+    Args:
+        unit, tuple: (constituent set, station, year, step, constituents, t, h)
+
+    Returns:
+        parsed result (None for a failed analysis) and a dict with time,
+        solver iterations, convergence and memory of the process
+    """
+    ky, nm, yr, step, constit, t, h = unit
+
+    t0 = time.perf_counter()
+    coef = tide.run_utide_solve(t, h,
+        constit = constit, **SOLVER_OPTIONS)
+    info = dict(
+        seconds = time.perf_counter() - t0, **solver_info(coef),
+        pid = os.getpid(), rss = ins.rss(), peak_rss = ins.peak_rss())
+
+    if isinstance(coef, str):
+        return None, info
+
+    tmp = tide.parse_utide(coef, include_phase = False)
+    tmp['year'] = [yr]
+    tmp['year_start'] = [yr - step]
+    return tmp, info
+
+
+def _labels(unit):
+    ky, nm, yr, step, constit, t, h = unit
+    return {'set': ky, 'naam': nm, 'year': yr, 'n': len(t)}
+
+
+def run_units(units, workers = WORKERS):
+    """
+    Generator solving work units in order; serial for a single worker,
+    otherwise on a pool of processes. Units may come from a generator; at
+    most a few units per worker are submitted ahead, which bounds memory.
+
+    Args:
+        units, iterable: work units, see make_units
+        workers, int: number of worker processes
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_worker) as pool:
+            pending = collections.deque()
+            for unit in tqdm(units):
+                pending.append((_labels(unit), pool.submit(solve_unit, unit)))
+                if len(pending) >= 4 * workers:
+                    labels, fut = pending.popleft()
+                    tmp, info = fut.result()
+                    ins.event('span', stage = 'solve', **labels, **info)
+                    yield tmp
+            while pending:
+                labels, fut = pending.popleft()
+                tmp, info = fut.result()
+                ins.event('span', stage = 'solve', **labels, **info)
+                yield tmp
+    else:
+        for unit in tqdm(units):
+            tmp, info = solve_unit(unit)
+            ins.event('span', stage = 'solve', **_labels(unit), **info)
+            yield tmp
+
+
+def check_table(cnxn):
+    """
+    Check that the observations have column tepoch_s; the database is not
+    modified here. Older databases are brought up to date once with
+    'python RWS_import_historic.py --upgrade'
+
+    Args:
+        cnxn, connection: RWS_data.db
+    """
+    cols = [row[1] for row in cnxn.execute("PRAGMA table_info('RWS_Waterinfo')")]
+    if 'tepoch_s' not in cols:
+        raise RuntimeError(
+            "Table RWS_Waterinfo has no column tepoch_s; upgrade the database "
+            "first with 'python RWS_import_historic.py --upgrade'")
+    idx = [row[1] for row in cnxn.execute("PRAGMA index_list('RWS_Waterinfo')")]
+    if reader.INDEX not in idx:
+        logging.warning(f"Index {reader.INDEX} missing; reading will be slow. "
+            "Create it with 'python RWS_import_historic.py --upgrade'")
+    return
+
+
+def unit_key(unit):
+    """
+    Key of a work unit in the results store
+    """
+    ky, nm, yr, step, constit, t, h = unit
+    return (
+        nm, int(yr), int(yr - step), ky,
+        store.options_key(constit = constit, **SOLVER_OPTIONS),
+        store.fingerprint(t, h))
+
+
+def analyse_parallel(df, cnst, step = 2, workers = WORKERS):
+    """
+    Run tide analysis for multi-year periods on a pool of processes.
+
+    The result equals the serial path (groupby per station followed by
+    analyse_grouped_years) row for row and in the same order.
+
+    Args:
+        df, dataframe: observations of all stations
+        cnst, dict: constituent sets
+        step, int: number of trailing years added to each window
+        workers, int: number of worker processes
+    """
+    heads = []
+
+    def units():
+        for unit in make_units(df, cnst, step = step):
+            heads.append(unit[:2])
+            yield unit
+
+    results = list(run_units(units(), workers = workers))
+    return collect(heads, results, cnst)
+
+
+def analyse_incremental(units, cnst, cnxn, workers = WORKERS):
+    """
+    Run tide analysis for the units missing in the results store only.
+
+    Units are found by station, year window, constituent set, solver
+    options and a fingerprint of the input rows. Every result is committed
+    as soon as it is available, so an interrupted run resumes from the last
+    stored unit.
+
+    Args:
+        units, iterable: work units, see make_units, units_from_cache and
+            units_from_sql
+        cnst, dict: constituent sets
+        cnxn, connection: database holding the results store
+        workers, int: number of worker processes
+    """
+    done = store.stored_keys(cnxn)
+    keys, heads = [], []
+    todo_keys = collections.deque()
+
+    def todo():
+        for unit in units:
+            key = unit_key(unit)
+            keys.append(key)
+            heads.append(unit[:2])
+            if key not in done:
+                todo_keys.append(key)
+                yield unit
+
+    for tmp in run_units(todo(), workers = workers):
+        key = todo_keys.popleft()
+        with ins.span('store', naam = key[0], year = key[1], set = key[3]):
+            store.put(cnxn, key, tmp)
+    print(f'{len(keys) - len(done & set(keys))} of {len(keys)} units analysed')
+
+    store.prune(cnxn, keys)
+    return collect(heads, store.get(cnxn, keys), cnst)
+
+
+def collect(units, results, cnst):
+    """
+    Combine results of work units to a single frame, indexed as the result
+    of the serial path; constituent sets without any result are left out
+
+    Args:
+        units, list: work units, see make_units; only the constituent set
+            and station (first two items) are used
+        results, list: parsed result (or None) per unit
+        cnst, dict: constituent sets
+    """
+    const_yr = pd.DataFrame()
+    for ky in cnst.keys():
+        per_station = {}
+        for unit, tmp in zip(units, results):
+            if unit[0] != ky or tmp is None:
+                continue
+            per_station.setdefault(unit[1], []).append(tmp)
+        if not per_station:
+            continue
+
+        tmp = pd.concat(
+            {nm: pd.concat(per_station[nm]) for nm in sorted(per_station)},
+            names = ['naam', None])
+        tmp['set'] = ky
+
+        const_yr = pd.concat([const_yr, tmp])
+    return const_yr
+
+
 def wrap_up():
     """
     Before ending the script:
@@ -149,37 +471,60 @@ def wrap_up():
     return
 
 
-#================= main ===================
-initialise()
-
-cnst = {
-    'short': ['M2', 'S2'],
-    'vRijn': ['M2', 'S2', 'N2', 'K2', 'K1', 'O1', 'P1'],
-    'PE': ['M2', 'S2', 'M4', 'SA', 'N2', 'O1', 'MS4']}
+def run(cnst = CNST, workers = WORKERS):
+    """
+    Yearly tide analysis of all stations, stored in table const_yr of the
+    output database; see initialise for the connections
 
-df = read_data(names)
-df = patch_ijmuiden()
+    Args:
+        cnst, dict: constituent sets
+        workers, int: number of worker processes
 
-# Analyse on yearly intervals
-const_yr = pd.DataFrame()
+    Returns:
+        dataframe const_yr
+    """
+    # Observations from the columnar cache when exported (see observationCache)
+    cache_dir = os.getenv("DATAPATH") + 'RWS_cache'
+    if os.path.isdir(cache_dir):
+        cache = oc.ObservationCache(cache_dir)
+        stations = [nm for nm in cache.stations if nm in names or nm in oc.ALIASES]
+        units = units_from_cache(cache, cnst, step = 0, stations = stations)
+    else:
+        # Stream from the database; IJmuiden stations merged in the query
+        stations = {nm: (nm, ) for nm in names}
+        stations.update(oc.ALIASES)
+        check_table(conn_in)
+        units = units_from_sql(conn_in, stations, cnst, step = 0)
+
+    # Analyse on yearly intervals; only units not in the store yet
+    with ins.span('analyse'):
+        const_yr = analyse_incremental(units, cnst, conn_out, workers = workers)
+    conn_in.close()
 
-for ky in cnst.keys():
-    os.system("cls")
-    print('Constituent set: ', ky)
+    # Store
+    with ins.span('to_sql', rows = len(const_yr)):
+        const_yr.to_sql(
+            name = 'const_yr',
+            con = conn_out,
+            if_exists = 'replace'
+        )
+    return const_yr
 
-    tmp = df.groupby('naam').apply(
-        lambda df: analyse_grouped_years(df, step = 0, constit = cnst[ky])
-    )
-    tmp['set'] = ky
 
-    const_yr = pd.concat([const_yr, tmp])
- 
-    
-# Store
-const_yr.to_sql(
-    name = 'const_yr',
-    con = conn_out,
-    if_exists = 'replace'
-) 
-
-wrap_up()
\ No newline at end of file
+#================= main ===================
+if __name__ == '__main__':
+    print("30_constit_calc commenced")
+    initialise()
+    const_yr = run()
+
+    # Summary of the instrumentation
+    records = pd.DataFrame(ins.recorder.records)
+    summary = ins.summary(records)
+    summary.to_csv('RWS_constits_summary.csv')
+    print(summary)
+    solves = records[records['stage'] == 'solve']
+    print(solves.nlargest(10, 'seconds')[['set', 'naam', 'year', 'n', 'seconds', 'iterations']])
+    print(f"{(solves['converged'] == False).sum()} of {len(solves)} fits not converged")
+    ins.recorder.close()
+
+    wrap_up()
\ No newline at end of file
@@ -9,6 +9,14 @@ Datum: 19 november 2019
 # Versiehistorie
 # =============================================================================
 20191119- Nieuwe sheet gebaseerd op "Import KNMI daggegevens", H.G. Voortman
+20261018- Bestanden in een enkele leesronde verwerkt met gevectoriseerde
+          datumconversie; soort (hoog-/laagwater) bewaard; bulk-insert in
+          een transactie, dubbelen geweerd door UNIQUE(naam, tijd)
+20261018- Kolom tepoch_s (int64 seconden sinds 1970) als tijdsleutel voor
+          het inlezen; bestaande databases worden eenmalig aangevuld.
+          tepoch_dy blijft voor bestaande gebruikers
+20261018- Aanvullen en opschonen van bestaande databases als aparte stap:
+          python RWS_import_historic.py --upgrade
 
 # =============================================================================
 # Beschrijving van de sheet
@@ -33,10 +41,14 @@ Datum: 19 november 2019
 1. Stel werkdirectory in
 2. Haal lijst met te verwerken bestanden op
 3. Loop in een cyclus alle bestanden af:
-    3a. Lees in
+    3a. Lees in (een keer per bestand)
     3b. Voeg locatiecode toe
-    3c. Schrijf naar database
+    3c. Schrijf naar database; bestaande (naam, tijd) worden overgeslagen
     3d. Verplaats bestand naar map "verwerkt"
+
+Met --upgrade wordt alleen een bestaande database bijgewerkt (kolommen
+soort en tepoch_s, dubbelen verwijderd, indexen); er wordt niets ingelezen.
+De analyse (RWS_constits) wijzigt de brondatabase niet.
 # =============================================================================
 # Open issues
 # =============================================================================
@@ -49,61 +61,137 @@ Datum: 19 november 2019
 """
 #%% 0. Import modules
 import pandas as pd
+import numpy as np
+import io
 import os
+import sys
 import sqlite3 as sq
 import datetime as dt
-import hvec_support.sqlite as hvsq
-
-
-def get_earliest_date():
-  """ 
-  Avoid importing overlapping data by getting the
-  earliest date present in the old data
-  """
-  sql = 'SELECT tijd FROM "RWS_Waterinfo" WHERE naam = "%s" '%station
-  date = pd.read_sql(sql, cnxn).min().squeeze()
-  return date
-
-os.chdir(os.getenv('DATAPATH') + r'/downloadspecs')
-
-#%% 20. Connect to database
-cnxn = sq.connect('../RWS_data.db', detect_types = True)
-#crsr = cnxn.cursor()
-
-#%% 30. Get list of files
-print("Create file list")
-file_list = []
-for file in os.listdir():
-    if ((file.endswith('.txt'))):
-        file_list.append(file)
-        print(file)
-
-#%% 4. Cycle over all available files
-for file in file_list:
-    # Determine name of tide station
-    f = open(file)
-    station = f.readline()
-    station = station.strip('\n')
-    print(station)
-    
-    # Skip lines until date is found for the first time
-    skip_cnt = 1
-    while True:
-        string = f.readline()
-        skip_cnt = skip_cnt + 1
-        if string.startswith('01-'):
-            skip_cnt = skip_cnt - 1
-            break
-    f.close() # Close file
-    
-    # Now read data, knowing the lines to skip
-    df = pd.read_csv(file, skiprows = skip_cnt, delim_whitespace = True,
-                     parse_dates = [[0, 1]],
-                     usecols = [0, 1, 3]
-                     )
-    
-    #%% Add a few additional columns
-    df.columns = ['tijd', 'waarde']
+
+import RWS_reader as reader
+
+
+COLUMNS = [
+    'tijd', 'waarde', 'soort', 'naam', 'bron', 'grootheid', 'eenheid',
+    'kwalico', 'statuswaarde', 'meetapparaat', 'bemonsteringsapparaat',
+    'year', 'tepoch_dy', 'tepoch_s']
+
+
+def prepare_table(cnxn):
+    """
+    Make sure the table exists with a unique key on (naam, tijd), a column
+    for the type of extreme (1 = high water, 2 = low water, ...) and the
+    time as integer seconds since 1970 (tepoch_s)
+    """
+    cnxn.execute(
+        "CREATE TABLE IF NOT EXISTS 'RWS_Waterinfo' ("
+        "tijd TIMESTAMP, waarde REAL, soort INTEGER, naam TEXT, bron TEXT, "
+        "grootheid TEXT, eenheid TEXT, kwalico TEXT, statuswaarde TEXT, "
+        "meetapparaat INTEGER, bemonsteringsapparaat INTEGER, year INTEGER, "
+        "tepoch_dy REAL, tepoch_s INTEGER)")
+
+    cols = [row[1] for row in cnxn.execute("PRAGMA table_info('RWS_Waterinfo')")]
+    if 'soort' not in cols:
+        cnxn.execute("ALTER TABLE 'RWS_Waterinfo' ADD COLUMN soort INTEGER")
+    if 'tepoch_s' not in cols:
+        # Once for older databases; computed in SQL from the stored day number
+        print("Add tepoch_s")
+        cnxn.execute("ALTER TABLE 'RWS_Waterinfo' ADD COLUMN tepoch_s INTEGER")
+        cnxn.execute(
+            "UPDATE 'RWS_Waterinfo' "
+            "SET tepoch_s = CAST(round(tepoch_dy * 86400) AS INTEGER)")
+        cnxn.execute(
+            "UPDATE 'RWS_Waterinfo' "
+            "SET tepoch_s = CAST(strftime('%s', tijd) AS INTEGER) "
+            "WHERE tepoch_s IS NULL")
+
+    try:
+        cnxn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_RWS_Waterinfo_naam_tijd "
+            "ON 'RWS_Waterinfo' (naam, tijd)")
+    except sq.IntegrityError:
+        # Older databases may hold doubles; remove them once
+        print("Remove doubles")
+        cnxn.execute(
+            "DELETE FROM 'RWS_Waterinfo' "
+            "WHERE rowid NOT IN ("
+                "SELECT MIN(rowid) "
+                "FROM 'RWS_Waterinfo' "
+                "GROUP BY naam, tijd)")
+        cnxn.execute(
+            "CREATE UNIQUE INDEX ux_RWS_Waterinfo_naam_tijd "
+            "ON 'RWS_Waterinfo' (naam, tijd)")
+    cnxn.commit()
+    return
+
+
+def upgrade(cnxn):
+    """
+    Bring an existing database up to date for the analysis: columns soort
+    and tepoch_s, doubles removed and the indexes of this module and of
+    RWS_reader. Modifies the database; run once, explicitly
+
+    Args:
+        cnxn, connection: RWS_data.db, opened for writing
+    """
+    prepare_table(cnxn)
+    reader.create_index(cnxn)
+    return
+
+
+def parse_time(datum, uur):
+    """
+    Vectorised conversion of 'dd-mm-yyyy' and 'hh:mm' strings; avoids the
+    slow general date parser
+
+    Returns:
+        tijd, array of strings 'yyyy-mm-dd hh:mm:00' as stored in the database
+        seconds, array of int64 seconds since 1970-01-01
+    """
+    d = np.asarray(datum, dtype = 'S10').view(np.uint8).reshape(-1, 10)
+    u = np.asarray(uur, dtype = 'S5').view(np.uint8).reshape(-1, 5)
+
+    def number(digits):
+        return (digits.astype(np.int64) - ord('0')) @ (10 ** np.arange(digits.shape[1])[::-1])
+
+    year, month, day = number(d[:, 6:10]), number(d[:, 3:5]), number(d[:, 0:2])
+    hour, minute = number(u[:, 0:2]), number(u[:, 3:5])
+
+    date = (
+        (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)
+        ).astype('datetime64[D]') + (day - 1)
+    seconds = date.astype('datetime64[s]').astype(np.int64) + 3600 * hour + 60 * minute
+
+    sep = lambda c: np.full((len(d), 1), ord(c), dtype = np.uint8)
+    tijd = np.hstack([
+        d[:, 6:10], sep('-'), d[:, 3:5], sep('-'), d[:, 0:2], sep(' '),
+        u, sep(':'), sep('0'), sep('0')])
+    return tijd.view('S19').ravel().astype(str), seconds
+
+
+def read_file(file):
+    """
+    Read a file in a single pass. The first line holds the station name;
+    data starts at the first line starting with '01-' and has the fixed
+    format 'dd-mm-yyyy hh:mm soort stand'.
+    """
+    with open(file) as f:
+        lines = f.read().splitlines()
+
+    station = lines[0].strip()
+    first = next(i for i, line in enumerate(lines) if line.startswith('01-'))
+
+    df = pd.read_csv(
+        io.StringIO('\n'.join(lines[first:])), sep = r'\s+', header = None,
+        names = ['datum', 'uur', 'soort', 'waarde'],
+        dtype = {'datum': str, 'uur': str, 'soort': np.int64, 'waarde': np.float64})
+
+    tijd, seconds = parse_time(df['datum'], df['uur'])
+
+    df = pd.DataFrame({
+        'tijd': tijd,
+        'waarde': df['waarde'],
+        'soort': df['soort']})
     df["naam"] = station
     df["bron"] = 'Historische waterstandsdata. Verkregen van RWS DID '
     'in het voorjaar van 2019 door H.G. Voortman'
@@ -113,40 +201,62 @@ for file in file_list:
     df["statuswaarde"] = 'Niet beschikbaar'
     df["meetapparaat"] = 999
     df["bemonsteringsapparaat"] = 999
-    df['year'] = df['tijd'].dt.date
-    df['tepoch_dy'] = (df["tijd"]-dt.datetime.utcfromtimestamp(0)).dt.total_seconds()/86400.
-
-    date_early = get_earliest_date() # Earliest date in data already downloaded
-    #df = df[df['tijd'] < date_early]
-
-    df.to_sql("RWS_Waterinfo", cnxn, if_exists = 'append', index = False)
-    print(file)
-    
-    #%% Move file
-    #os.rename(file, r"../verwerkte downloads/" + file)
-    
-    #%% Update log
-    dt_today = dt.date.today()
-    bron = 'RWS'
-    note = 'Bestand '+file+' geimporteerd'
-    entry = pd.DataFrame([dt_today, bron, note])
-    entry = entry.transpose()
-    entry.columns = ["Date", "Source", "Note"]
-    entry.to_sql("Logboek_databeheer", cnxn, if_exists = 'append', 
-                 index = False)
-
-print("Remove doubles and vacuum")
-sql = (
-        "DELETE FROM 'RWS_Waterinfo' "
-        "WHERE rowid NOT IN ("
-            "SELECT MIN(rowid) " 
-            "FROM 'RWS_Waterinfo' " 
-            "GROUP BY naam, tijd)"
-            )
-    
-cnxn.execute(sql)
-cnxn.commit()
-#cnxn = sq.connect('../RWS_data.db')
-cnxn.execute("VACUUM")
-cnxn.close()
-# End script
\ No newline at end of file
+    df['year'] = seconds.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+    df['tepoch_dy'] = seconds / 86400.
+    df['tepoch_s'] = seconds
+    return station, df[COLUMNS]
+
+
+def insert(cnxn, df):
+    """
+    Bulk-insert in the current transaction; rows of which (naam, tijd) is
+    already present are skipped
+    """
+    sql = (
+        f"INSERT OR IGNORE INTO 'RWS_Waterinfo' ({', '.join(COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(COLUMNS))})")
+    before = cnxn.total_changes
+    cnxn.executemany(sql, df.itertuples(index = False, name = None))
+    return cnxn.total_changes - before
+
+
+#================= main ===================
+if __name__ == '__main__':
+    os.chdir(os.getenv('DATAPATH') + r'/downloadspecs')
+
+    #%% 20. Connect to database
+    cnxn = sq.connect('../RWS_data.db', detect_types = True)
+    if '--upgrade' in sys.argv[1:]:
+        upgrade(cnxn)
+        cnxn.close()
+        sys.exit()
+    prepare_table(cnxn)
+
+    #%% 30. Get list of files
+    print("Create file list")
+    file_list = []
+    for file in os.listdir():
+        if ((file.endswith('.txt'))):
+            file_list.append(file)
+            print(file)
+
+    #%% 4. Cycle over all available files; a single transaction
+    with cnxn:
+        for file in file_list:
+            station, df = read_file(file)
+            n = insert(cnxn, df)
+            print(station, file, f'{n} of {len(df)} rows added')
+
+            #%% Move file
+            #os.rename(file, r"../verwerkte downloads/" + file)
+
+            #%% Update log
+            cnxn.execute(
+                "CREATE TABLE IF NOT EXISTS 'Logboek_databeheer' "
+                "(Date TIMESTAMP, Source TEXT, Note TEXT)")
+            cnxn.execute(
+                "INSERT INTO 'Logboek_databeheer' (Date, Source, Note) VALUES (?, ?, ?)",
+                (str(dt.date.today()), 'RWS', 'Bestand ' + file + ' geimporteerd'))
+
+    cnxn.close()
+# End script
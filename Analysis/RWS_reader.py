@@ -0,0 +1,124 @@
+"""
+Streaming access to observed water levels in RWS_data.db.
+
+Observations are read per station (or combined station) and per year with
+indexed SQL on (naam, grootheid, tepoch_s). Merging of combined stations,
+removal of double time stamps and the year selection are done in the
+query, so at most a single analysis window is held in memory. Time is read
+as integer epoch seconds and converted with epochTime; no time text is
+parsed. The query and the conversion of every year are recorded as spans
+read_sql and convert of instrumentation.
+
+HVEC-lab, 2026
+"""
+
+import collections
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import epochTime as et
+import instrumentation as ins
+
+
+INDEX = 'ix_RWS_Waterinfo_naam_grootheid_tepoch_s'
+
+
+def create_index(cnxn):
+    """
+    Index used by the queries of this module; created once. The table
+    needs column tepoch_s, see RWS_import_historic.upgrade
+
+    Args:
+        cnxn, connection: RWS_data.db, opened for writing
+    """
+    cnxn.execute("DROP INDEX IF EXISTS ix_RWS_Waterinfo_naam_grootheid_tijd")
+    cnxn.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX} "
+        "ON 'RWS_Waterinfo' (naam, grootheid, tepoch_s)")
+    cnxn.commit()
+    return
+
+
+def _in(sources):
+    return f"naam IN ({', '.join('?' * len(sources))})"
+
+
+def station_years(cnxn, sources, last = 2021):
+    """
+    Years with water level data of a (combined) station
+
+    Args:
+        cnxn, connection: RWS_data.db
+        sources, tuple: station names combined under a single name
+        last, int: last year included
+    """
+    sql = (
+        "SELECT DISTINCT CAST(strftime('%Y', tepoch_s, 'unixepoch') AS INTEGER) AS year "
+        "FROM 'RWS_Waterinfo' "
+        f"WHERE {_in(sources)} AND grootheid = 'WATHTE' AND tepoch_s < ? "
+        "ORDER BY year"
+    )
+    rows = cnxn.execute(sql, (*sources, int(et.year_start(last + 1))))
+    return [row[0] for row in rows]
+
+
+def read_year(cnxn, sources, yr):
+    """
+    Water levels of a (combined) station in a single year. Of double time
+    stamps the first stored row is kept.
+
+    Args:
+        cnxn, connection: RWS_data.db
+        sources, tuple: station names combined under a single name
+        yr, int: year
+
+    Returns:
+        dataframe with time t (days since 1970) and level h (m)
+    """
+    sql = (
+        "SELECT tepoch_s, waarde/100., MIN(rowid) "
+        "FROM 'RWS_Waterinfo' "
+        f"WHERE {_in(sources)} AND grootheid = 'WATHTE' "
+        "AND tepoch_s >= ? AND tepoch_s < ? "
+        "GROUP BY tepoch_s "
+        "ORDER BY tepoch_s"
+    )
+    bounds = et.year_start([yr, yr + 1])
+    with ins.span('read_sql', naam = sources[0], year = yr) as info:
+        rows = cnxn.execute(sql, (*sources, int(bounds[0]), int(bounds[1]))).fetchall()
+        info['rows'] = len(rows)
+    with ins.span('convert', naam = sources[0], year = yr):
+        seconds = np.fromiter((row[0] for row in rows), dtype = np.int64, count = len(rows))
+        h = np.fromiter((row[1] for row in rows), dtype = np.float64, count = len(rows))
+        return pd.DataFrame({'t': et.epoch_days(seconds), 'h': h})
+
+
+def stream(cnxn, stations, step = 0, last = 2021):
+    """
+    Generator of trailing analysis windows, one station and one year at a
+    time. Every year is read once; a window holds the years yr - step up to
+    and including yr.
+
+    Args:
+        cnxn, connection: RWS_data.db
+        stations, dict: name: tuple of source station names
+        step, int: number of trailing years added to each window
+        last, int: last year included
+
+    Yields:
+        name, year and dataframe with columns t, h and year
+    """
+    for nm, sources in stations.items():
+        years = station_years(cnxn, sources, last = last)
+        window = collections.OrderedDict()
+
+        for i, yr in enumerate(years):
+            window[yr] = read_year(cnxn, sources, yr).assign(year = yr)
+            for old in [y for y in window if y < yr - step]:
+                del window[old]
+
+            if i >= step:
+                yield nm, yr, pd.concat(window.values(), ignore_index = True)
@@ -0,0 +1,135 @@
+"""
+Results store for the yearly tide analysis.
+
+Every work unit (station, year window, constituent set) is stored under a
+key of its solver options and a fingerprint of its input rows. A rerun only
+analyses the units of which the input or the settings changed. Each unit is
+committed separately, so an interrupted run resumes where it stopped.
+
+HVEC-lab, 2026
+"""
+
+import hashlib
+import json
+import pandas as pd
+
+
+TABLE = 'const_units'
+
+
+def create(cnxn):
+    """
+    Create the store table if it does not exist yet
+
+    Args:
+        cnxn, connection: database with processed data
+    """
+    cnxn.execute(
+        f"CREATE TABLE IF NOT EXISTS '{TABLE}' ("
+        "naam TEXT NOT NULL, "
+        "year INTEGER NOT NULL, "
+        "year_start INTEGER NOT NULL, "
+        "const_set TEXT NOT NULL, "
+        "options TEXT NOT NULL, "
+        "fingerprint TEXT NOT NULL, "
+        "result TEXT, "
+        "PRIMARY KEY (naam, year, year_start, const_set, options, fingerprint))"
+    )
+    cnxn.commit()
+    return
+
+
+def options_key(**options):
+    """
+    Short hash of the solver options, including the constituent list
+    """
+    text = json.dumps(options, sort_keys = True, default = str)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def fingerprint(t, h):
+    """
+    Hash of the input rows of a work unit
+
+    Args:
+        t, array: time
+        h, array: water level
+    """
+    sha = hashlib.sha1()
+    sha.update(t.tobytes())
+    sha.update(h.tobytes())
+    return sha.hexdigest()
+
+
+def stored_keys(cnxn):
+    """
+    Keys of all units present in the store
+    """
+    sql = (
+        "SELECT naam, year, year_start, const_set, options, fingerprint "
+        f"FROM '{TABLE}'"
+    )
+    return set(cnxn.execute(sql).fetchall())
+
+
+def put(cnxn, key, res):
+    """
+    Store the result of a single unit and commit
+
+    Failed analyses are stored as well (result NULL), so they are not
+    retried until their input changes. Values are written with the
+    shortest repr that reads back to the same float, so a result rebuilt
+    from the store equals the analysed one.
+
+    Args:
+        cnxn, connection: database with processed data
+        key, tuple: (naam, year, year_start, const_set, options, fingerprint)
+        res, dataframe or None: parsed result of the tide analysis
+    """
+    result = None if res is None else json.dumps(res.to_dict(orient = 'records'))
+    cnxn.execute(
+        f"INSERT OR REPLACE INTO '{TABLE}' "
+        "(naam, year, year_start, const_set, options, fingerprint, result) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (*key, result))
+    cnxn.commit()
+    return
+
+
+def get(cnxn, keys):
+    """
+    Results of the requested units, in the order of the keys; the store is
+    read in a single query
+
+    Args:
+        cnxn, connection: database with processed data
+        keys, list of tuples: see put
+    """
+    sql = (
+        "SELECT naam, year, year_start, const_set, options, fingerprint, result "
+        f"FROM '{TABLE}' WHERE result IS NOT NULL"
+    )
+    stored = {tuple(row[:-1]): row[-1] for row in cnxn.execute(sql)}
+    res = []
+    for key in keys:
+        text = stored.get(tuple(key))
+        res.append(None if text is None else pd.DataFrame(json.loads(text)))
+    return res
+
+
+def prune(cnxn, keys):
+    """
+    Remove all units that are not in keys, e.g. after a change of settings
+
+    Args:
+        cnxn, connection: database with processed data
+        keys, iterable of tuples: units to keep
+    """
+    stale = stored_keys(cnxn) - set(keys)
+    cnxn.executemany(
+        f"DELETE FROM '{TABLE}' "
+        "WHERE naam = ? AND year = ? AND year_start = ? AND const_set = ? "
+        "AND options = ? AND fingerprint = ?",
+        list(stale))
+    cnxn.commit()
+    return len(stale)
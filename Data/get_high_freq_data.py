@@ -1,40 +1,296 @@
 """
-Short additional program getting high-frequency data for a single year and
-putting it in a database.
+Short additional program getting high-frequency data and putting it in a
+database.
 
-HVEC-lab, 2023
+Stations and months are fetched concurrently from the Waterinfo web services
+(asyncio, bounded number of open requests, retry with back-off). Every month
+of a station is a chunk. A chunk is recorded in the table manifest after a
+successful reply, with 0 rows for a month without data; failed chunks are
+written to the log and fetched again on the next run. Observations are
+upserted on the unique key (Naam, Tijdstip).
+
+Table data holds the columns Naam, Tijdstip and Waarde (cm) only, which is
+what Section 4b reads; the previous version stored the full frame of
+hvec_importers.rws. In an existing database the extra columns stay and are
+left empty for new rows. Tijdstip is stored in a single form, 'yyyy-mm-dd
+hh:mm:ss+01:00' (MET, the time zone of Waterinfo); time stamps in other
+forms, written by earlier versions, are converted once by prepare.
+
+Stations are looked up in the catalogue by code; several locations may
+share a name.
+
+Set WATERINFO_URL to use another server, e.g. the local stand-in in
+mock_waterinfo.py for offline testing.
+
+HVEC-lab, 2023; concurrent and resumable 2026
 """
 
-import pandas as pd
+import asyncio
+import datetime as dt
+import json
+import os
+import random
 import sqlite3 as sq
+import urllib.error
+import urllib.request
+import pandas as pd
 
-from hvec_importers import rws
 from hvec_support import sqlite as hvsq
 
 
-# Create database
-cnxn = sq.connect('data_single_year_high_freq.db', detect_types = True)
-
-names = [
-      'Vlissingen'
-    , 'Hoek van Holland'
-    , 'IJmuiden Noordersluis'
-    , 'Den Helder'
-    , 'Harlingen'
-    , 'Delfzijl']
-
-start = '2020-1-1'
-end = '2020-12-31'
-for nm in (names):
-    print(nm)
-    df = rws.data_single_name(name = nm, quantity = 'WATHTE', start = start, end = end, reduce = False)
-    df.to_sql(name = 'data', con = cnxn, if_exists = 'append')
-    hvsq.write_log(entry = f'High frequency data of {nm} stored', cnxn = cnxn)
-
-hvsq.write_log(entry = 'Removing double entries', cnxn = cnxn)
-hvsq.remove_doubles(cnxn = cnxn, table = 'data', columns = ['Naam', 'Tijdstip'])
-
-hvsq.write_log(entry = 'Vacuum database', cnxn = cnxn)
-cnxn.execute('VACUUM')
-cnxn.close()
-input("That's all folks!")
+# Settings
+URL = os.getenv('WATERINFO_URL', 'https://waterwebservices.rijkswaterstaat.nl')
+CATALOGUE = '/METADATASERVICES_DBO/OphalenCatalogus'
+OBSERVATIONS = '/ONLINEWAARNEMINGENSERVICESDBO/OphalenWaarnemingen'
+
+DATABASE = 'data_single_year_high_freq.db'
+
+# Name: location code in the catalogue
+STATIONS = {
+      'Vlissingen': 'VLISSGN'
+    , 'Hoek van Holland': 'HOEKVHLD'
+    , 'IJmuiden Noordersluis': 'IJMDNDSS'
+    , 'Den Helder': 'DENHDR'
+    , 'Harlingen': 'HARLGN'
+    , 'Delfzijl': 'DELFZL'}
+NAMES = list(STATIONS)
+
+QUANTITY = 'WATHTE'
+START = '2020-1-1'
+END = '2020-12-31'
+
+MET = dt.timezone(dt.timedelta(hours = 1))  # Time zone of Waterinfo
+CANONICAL = (  # GLOB of the stored form of Tijdstip
+    '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] '
+    '[0-9][0-9]:[0-9][0-9]:[0-9][0-9]+01:00')
+NO_DATA = 'Geen gegevens gevonden'  # Message of a period without data
+
+CONCURRENCY = 8  # Open requests
+RETRIES = 5
+TIMEOUT = 120  # s
+
+
+class ReplyError(RuntimeError):
+    """
+    Unsuccessful reply of the web service (Succesvol false for another
+    reason than a period without data, or no WaarnemingenLijst)
+    """
+
+
+def canonical(stamp):
+    """
+    Time stamp in the stored form 'yyyy-mm-dd hh:mm:ss+01:00'; ISO text with
+    any offset is converted to MET, text without offset is taken as MET
+    """
+    t = dt.datetime.fromisoformat(str(stamp))
+    t = t.replace(tzinfo = MET) if t.tzinfo is None else t.astimezone(MET)
+    return t.isoformat(sep = ' ', timespec = 'seconds')
+
+
+def normalise(cnxn):
+    """
+    Convert time stamps of earlier versions to the stored form, see
+    canonical; the unique index is removed first and created by prepare
+
+    Returns:
+        number of rows converted
+    """
+    rows = cnxn.execute(
+        "SELECT rowid, CAST(Tijdstip AS TEXT) FROM data WHERE Tijdstip NOT GLOB ?",
+        (CANONICAL, )).fetchall()
+    if rows:
+        print(f'Convert {len(rows)} time stamps')
+        cnxn.execute("DROP INDEX IF EXISTS ix_data_Naam_Tijdstip")
+        cnxn.executemany(
+            "UPDATE data SET Tijdstip = ? WHERE rowid = ?",
+            [(canonical(t), rowid) for rowid, t in rows])
+    return len(rows)
+
+
+def prepare(cnxn):
+    """
+    Tables data (unique on Naam, Tijdstip, time stamps in a single form) and
+    manifest
+    """
+    cnxn.execute(
+        "CREATE TABLE IF NOT EXISTS data "
+        "(Naam TEXT, Tijdstip TEXT, Waarde REAL)")
+    normalise(cnxn)
+    try:
+        cnxn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_data_Naam_Tijdstip "
+            "ON data (Naam, Tijdstip)")
+    except sq.IntegrityError:
+        # Database written by an earlier version; remove doubles once
+        hvsq.remove_doubles(cnxn = cnxn, table = 'data', columns = ['Naam', 'Tijdstip'])
+        cnxn.execute(
+            "CREATE UNIQUE INDEX ix_data_Naam_Tijdstip "
+            "ON data (Naam, Tijdstip)")
+
+    cnxn.execute(
+        "CREATE TABLE IF NOT EXISTS manifest "
+        "(Naam TEXT, Grootheid TEXT, Begin TEXT, Eind TEXT, Rijen INTEGER, "
+        "Opgehaald TEXT, PRIMARY KEY (Naam, Grootheid, Begin))")
+    cnxn.commit()
+    return
+
+
+def chunks(start, end):
+    """
+    Months between start and end (inclusive) as (begin, end) timestamps
+    """
+    bounds = pd.date_range(pd.Timestamp(start).replace(day = 1), end, freq = 'MS')
+    bounds = bounds.append(pd.DatetimeIndex([pd.Timestamp(end) + pd.Timedelta(days = 1)]))
+    return [
+        (max(b, pd.Timestamp(start)), e - pd.Timedelta(seconds = 1))
+        for b, e in zip(bounds[:-1], bounds[1:])]
+
+
+def missing(cnxn, names, quantity, start, end):
+    """
+    Chunks not in the manifest
+    """
+    done = {
+        (row[0], row[1]) for row in cnxn.execute(
+            "SELECT Naam, Begin FROM manifest WHERE Grootheid = ?", (quantity, ))}
+    return [
+        (nm, b, e) for nm in names for b, e in chunks(start, end)
+        if (nm, _stamp(b)) not in done]
+
+
+def _stamp(t):
+    return t.strftime('%Y-%m-%dT%H:%M:%S.000+01:00')
+
+
+def _post(url, body):
+    """
+    Blocking POST of a JSON body; run in a thread
+    """
+    req = urllib.request.Request(
+        url, data = json.dumps(body).encode(),
+        headers = {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout = TIMEOUT) as resp:
+        return json.loads(resp.read())
+
+
+async def post(url, body, limit, retries = RETRIES):
+    """
+    POST with bounded concurrency and exponential back-off on failure
+    """
+    for attempt in range(retries):
+        try:
+            async with limit:
+                return await asyncio.to_thread(_post, url, body)
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as err:
+            if isinstance(err, urllib.error.HTTPError) and err.code < 500 and err.code != 429:
+                raise
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(2**attempt + random.random())
+
+
+async def locations(limit):
+    """
+    Location records of the catalogue by code; names are not unique
+    """
+    body = {'CatalogusFilter': {'Compartimenten': True, 'Grootheden': True}}
+    res = await post(URL + CATALOGUE, body, limit)
+    return {loc['Code']: loc for loc in res['LocatieLijst']}
+
+
+async def fetch(loc, quantity, begin, end, limit):
+    """
+    Observations of a single chunk as rows (Naam, Tijdstip, Waarde); water
+    levels in cm. A period without data gives no rows; other unsuccessful
+    replies raise ReplyError
+    """
+    body = {
+        'Locatie': {'Code': loc['Code'], 'X': loc['X'], 'Y': loc['Y']},
+        'AquoPlusWaarnemingMetadata': {
+            'AquoMetadata': {
+                'Compartiment': {'Code': 'OW'}, 'Grootheid': {'Code': quantity}}},
+        'Periode': {'Begindatumtijd': _stamp(begin), 'Einddatumtijd': _stamp(end)}}
+    res = await post(URL + OBSERVATIONS, body, limit)
+    if not res.get('Succesvol') and NO_DATA in (res.get('Foutmelding') or ''):
+        return []
+    if not res.get('Succesvol') or 'WaarnemingenLijst' not in res:
+        raise ReplyError(res.get('Foutmelding', 'No observations in reply'))
+
+    rows = []
+    for series in res['WaarnemingenLijst']:
+        for obs in series['MetingenLijst']:
+            value = obs['Meetwaarde'].get('Waarde_Numeriek')
+            if value is None or value > 1e4:  # Missing values are coded 999999999
+                continue
+            rows.append((loc['Naam'], canonical(obs['Tijdstip']), value))
+    return rows
+
+
+def store(cnxn, nm, quantity, begin, end, rows):
+    """
+    Upsert a chunk and record it in the manifest, in a single transaction;
+    only for chunks of a successful reply, see fetch. A month without data
+    is recorded with 0 rows, so it is not requested again
+    """
+    with cnxn:
+        cnxn.executemany(
+            "INSERT INTO data (Naam, Tijdstip, Waarde) VALUES (?, ?, ?) "
+            "ON CONFLICT (Naam, Tijdstip) DO UPDATE SET Waarde = excluded.Waarde",
+            rows)
+        cnxn.execute(
+            "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?)",
+            (nm, quantity, _stamp(begin), _stamp(end), len(rows),
+                dt.datetime.now().isoformat(timespec = 'seconds')))
+    return
+
+
+async def download(cnxn, names = NAMES, quantity = QUANTITY, start = START, end = END,
+        concurrency = CONCURRENCY):
+    """
+    Fetch all missing chunks; chunks are stored as they arrive
+
+    Returns:
+        number of chunks stored and list of failed chunks (name, begin,
+        end, error); these are fetched again on the next run
+    """
+    todo = missing(cnxn, names, quantity, start, end)
+    if not todo:
+        return 0, []
+
+    limit = asyncio.Semaphore(concurrency)
+    locs = await locations(limit)
+
+    async def task(nm, begin, end):
+        try:
+            return nm, begin, end, await fetch(locs[STATIONS[nm]], quantity, begin, end, limit)
+        except Exception as err:
+            return nm, begin, end, err
+
+    tasks = [asyncio.ensure_future(task(*chunk)) for chunk in todo]
+    stored, failed = 0, []
+    for fut in asyncio.as_completed(tasks):
+        nm, begin, end, rows = await fut
+        if isinstance(rows, Exception):
+            failed.append((nm, begin, end, rows))
+            continue
+        store(cnxn, nm, quantity, begin, end, rows)
+        stored += 1
+        print(nm, begin.date(), len(rows))
+    return stored, failed
+
+
+#================= main ===================
+if __name__ == '__main__':
+    cnxn = sq.connect(DATABASE, detect_types = True)
+    prepare(cnxn)
+
+    stored, failed = asyncio.run(download(cnxn))
+    hvsq.write_log(
+        entry = f'High frequency data: {stored} chunks stored, {len(failed)} failed',
+        cnxn = cnxn)
+    for nm, begin, _, err in failed:
+        print('Failed:', nm, begin.date(), repr(err))
+        hvsq.write_log(
+            entry = f'High frequency data of {nm} from {begin.date()} failed: {err!r}',
+            cnxn = cnxn)
+    cnxn.close()
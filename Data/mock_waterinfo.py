@@ -0,0 +1,108 @@
+"""
+Local stand-in for the Waterinfo web services, for offline testing of
+get_high_freq_data.py.
+
+Serves the catalogue and synthetic 10-minute water levels (tide and noise,
+in cm) for the requested location and period. Latency, a fraction of
+failed requests (HTTP 503), a fraction of unsuccessful replies (HTTP 200,
+Succesvol false) and months without data can be set to test concurrency,
+retry and resume.
+
+Usage:
+    python mock_waterinfo.py [port]
+    WATERINFO_URL=http://localhost:8000 python get_high_freq_data.py
+
+HVEC-lab, 2026
+"""
+
+import json
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+
+LOCATIONS = [
+    {'Code': 'VLISSGN', 'Naam': 'Vlissingen', 'X': 541425.0, 'Y': 5699182.0},
+    {'Code': 'HOEKVHLD', 'Naam': 'Hoek van Holland', 'X': 576917.0, 'Y': 5759136.0},
+    {'Code': 'IJMDNDSS', 'Naam': 'IJmuiden Noordersluis', 'X': 605633.0, 'Y': 5813598.0},
+    {'Code': 'DENHDR', 'Naam': 'Den Helder', 'X': 617198.0, 'Y': 5869853.0},
+    {'Code': 'HARLGN', 'Naam': 'Harlingen', 'X': 660700.0, 'Y': 5894987.0},
+    {'Code': 'DELFZL', 'Naam': 'Delfzijl', 'X': 761899.0, 'Y': 5915116.0},
+]
+
+LATENCY = 0.2  # s per request
+FAILURES = 0.1  # Fraction of requests answered with 503
+UNSUCCESSFUL = 0.05  # Fraction of observation requests answered with an error
+EMPTY = ('2020-06', )  # Months without data
+
+
+def levels(code, begin, end):
+    """
+    Synthetic 10-minute water levels (cm); reproducible per location
+    """
+    t = pd.date_range(begin[:19], end[:19], freq = '10min')
+    s = t.asi8 / 1e9
+    rng = np.random.default_rng(zlib.crc32((code + begin).encode()))
+    h = (
+        100 * np.cos(2 * np.pi * s / 44714.2) + 30 * np.cos(2 * np.pi * s / 43200.)
+        + 10 * np.cos(2 * np.pi * s / 22357.1 + 1) + 5 * rng.standard_normal(len(s)))
+    return t, np.round(h)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(LATENCY)
+        if np.random.random() < FAILURES:
+            self.send_error(503)
+            return
+
+        if self.path.endswith('OphalenCatalogus'):
+            res = {'Succesvol': True, 'LocatieLijst': LOCATIONS}
+        elif self.path.endswith('OphalenWaarnemingen') and np.random.random() < UNSUCCESSFUL:
+            res = {'Succesvol': False, 'Foutmelding': 'Interne fout'}
+        elif self.path.endswith('OphalenWaarnemingen') and body['Periode']['Begindatumtijd'][:7] in EMPTY:
+            res = {'Succesvol': False, 'Foutmelding': 'Geen gegevens gevonden!'}
+        elif self.path.endswith('OphalenWaarnemingen'):
+            loc = body['Locatie']
+            period = body['Periode']
+            t, h = levels(loc['Code'], period['Begindatumtijd'], period['Einddatumtijd'])
+            name = {l['Code']: l['Naam'] for l in LOCATIONS}[loc['Code']]
+            res = {'Succesvol': True, 'WaarnemingenLijst': [{
+                'Locatie': dict(loc, Naam = name),
+                'MetingenLijst': [
+                    {'Tijdstip': ti.strftime('%Y-%m-%dT%H:%M:%S.000+01:00'),
+                     'Meetwaarde': {'Waarde_Numeriek': hi}}
+                    for ti, hi in zip(t, h)]}]}
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(res).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        return
+
+
+def serve(port = 8000):
+    """
+    Run the stand-in server until interrupted
+    """
+    server = ThreadingHTTPServer(('localhost', port), Handler)
+    print(f'Mock Waterinfo on http://localhost:{port}')
+    server.serve_forever()
+    return
+
+
+#================= main ===================
+if __name__ == '__main__':
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
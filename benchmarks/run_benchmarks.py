@@ -0,0 +1,181 @@
+"""
+Benchmarks of the hot paths of the project on synthetic data.
+
+For every scale, synthetic databases are written to a temporary folder (see
+synthetic.py) and the following steps are timed, with the peak of the
+memory allocated by Python (tracemalloc):
+    read_data          RWS_reader.stream, observations of two stations
+    tide_utide         yearly tide analysis with utide (hvec_tide)
+    tide_batched       yearly tide analysis with harmonicAnalysis
+    tide_batched_rws   the same through RWS_constits.analyse_batched
+    read_data_rws      utils.read_data_rws, first call and memoised call
+    fit_reduced        regressionModels.linear_fit of reducedModel
+    fit_full           regressionModels.breakpoint_fit of fullModel
+    graph_z0           utils.graph_z0, mean sea level against PSMSL
+    figures            utils.graph_* on the Agg backend
+
+RWS_constits needs hvec_support and hvec_tide; it is imported by the cases
+that use it only, so the other cases run without these packages.
+
+Usage:
+    python benchmarks/run_benchmarks.py [scale ...] [--repeat n] [--out file.csv]
+
+HVEC-lab, 2026
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+import sqlite3 as sq
+
+import synthetic as sy  # Adds the project folders to the path
+import harmonicAnalysis as hx
+import regressionModels as mdl
+import RWS_reader as reader
+import utils
+
+
+# Stations, years of 10-minute data, years of yearly results
+SCALES = {
+    'small': dict(stations = 6, years = 1, yearly = (1990, 2021)),
+    'medium': dict(stations = 6, years = 3, yearly = (1890, 2021)),
+    'large': dict(stations = 12, years = 10, yearly = (1890, 2021)),
+}
+
+YR_END = 2021
+
+
+def measure(func, repeat = 3):
+    """
+    Best wall-clock time (s) of a number of runs and the peak memory (MB)
+    allocated by Python in the first run
+    """
+    if repeat < 1:
+        raise ValueError(f'repeat must be at least 1, not {repeat}')
+    times = []
+    for i in range(repeat):
+        if i == 0:
+            tracemalloc.start()
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+        if i == 0:
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    return min(times), peak
+
+
+def cases(folder, scale):
+    """
+    Benchmark cases of a scale as name: function; writes the synthetic
+    databases
+    """
+    cfg = SCALES[scale]
+    obs = os.path.join(folder, 'RWS_data.db')
+    res = os.path.join(folder, 'RWS_JCHS.db')
+    sy.write_observations(obs, cfg['stations'], YR_END - cfg['years'] + 1, YR_END)
+    sy.write_results(res, cfg['stations'], *cfg['yearly'])
+
+    pair = tuple(sy.station_names(2))
+
+    def read_data():
+        cnxn = sq.connect(obs)
+        res = [data for _, _, data in reader.stream(cnxn, {nm: (nm, ) for nm in pair})]
+        cnxn.close()
+        return res
+
+    # Observations of the first station
+    cnxn = sq.connect(obs)
+    df = pd.concat([
+        reader.read_year(cnxn, pair[:1], yr).assign(year = yr)
+        for yr in reader.station_years(cnxn, pair[:1])], ignore_index = True)
+    df['naam'] = pair[0]
+    cnxn.close()
+
+    def tide_utide():
+        import RWS_constits as rc
+        return rc.analyse_grouped_years(df, sy.PE, step = 0)
+
+    def tide_batched_rws():
+        import RWS_constits as rc
+        return rc.analyse_batched(df, sy.PE, step = 0)
+
+    def read_data_rws_cold():
+        utils._memo.clear()
+        return utils.read_data_rws('PE', file = res)
+
+    yearly = utils.read_data_rws('PE', file = res)
+    wide = yearly.pivot_table(index = 'year', columns = 'naam', values = 'z0')
+    t, Y = wide.index.to_numpy(dtype = float), wide.to_numpy()
+    psmsl = sy.psmsl_levels(cfg['stations'], *cfg['yearly'])
+
+    def graph_z0():
+        utils.graph_z0(yearly, psmsl)
+        plt.close('all')
+
+    def figures():
+        utils.graph_Rsqadj(yearly)
+        utils.graph_amplitudes(yearly)
+        utils.graph_windeffect(yearly)
+        plt.close('all')
+
+    return {
+        'read_data': read_data,
+        'tide_utide': tide_utide,
+        'tide_batched': lambda: hx.solve_years(df['t'], df['h'], df['year'], sy.PE),
+        'tide_batched_rws': tide_batched_rws,
+        'read_data_rws': read_data_rws_cold,
+        'read_data_rws_memo': lambda: utils.read_data_rws('PE', file = res),
+        'fit_reduced': lambda: mdl.linear_fit(mdl.reducedModel, t, Y),
+        'fit_full': lambda: mdl.breakpoint_fit(t, Y),
+        'graph_z0': graph_z0,
+        'figures': figures,
+    }
+
+
+def run(scales, repeat = 3, only = None):
+    """
+    Run the benchmarks
+
+    Returns:
+        dataframe with scale, case, time (s) and peak memory (MB)
+    """
+    rows = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as folder:
+            utils.PICTURES = folder
+            for name, func in cases(folder, scale).items():
+                if only and name not in only:
+                    continue
+                try:
+                    seconds, peak = measure(func, repeat = repeat)
+                except Exception as err:  # e.g. hvec_tide not installed
+                    print(f'{scale:8s} {name:20s} failed: {err!r}')
+                    continue
+                rows.append({'scale': scale, 'case': name, 'time_s': seconds, 'peak_MB': peak})
+                print(f'{scale:8s} {name:20s} {seconds:10.4f} s {peak:10.1f} MB')
+    return pd.DataFrame(rows)
+
+
+#================= main ===================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks on synthetic data')
+    parser.add_argument('scales', nargs = '*', help = f'{", ".join(SCALES)}; default small')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--only', nargs = '*', help = 'Cases to run')
+    parser.add_argument('--out', help = 'CSV file for the results')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    if set(args.scales) - set(SCALES):
+        parser.error(f'unknown scale(s): {sorted(set(args.scales) - set(SCALES))}')
+
+    res = run(args.scales or ['small'], repeat = args.repeat, only = args.only)
+    if args.out:
+        res.to_csv(args.out, index = False)
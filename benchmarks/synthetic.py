@@ -0,0 +1,243 @@
+"""
+Deterministic synthetic tide-gauge data for benchmarks.
+
+Water levels are the sum of
+    - mean sea level from regressionModels.fullModel: trend, acceleration and
+      jerk after t0, the 8.85-year perigean and the 18.61-year nodal cycle;
+    - the astronomical tide of a fixed set of constituents, with the nodal
+      modulation of the lunar amplitudes;
+    - an autoregressive surge and white measurement noise.
+Every station gets its own reproducible random generator, so the same call
+gives the same data on every machine.
+
+Databases are written in the layout of the project:
+    RWS_data.db   table RWS_Waterinfo, 10-minute and/or high and low waters
+    RWS_JCHS.db   table const_yr, yearly analysis results
+
+HVEC-lab, 2026
+"""
+
+import os
+import sys
+import zlib
+import numpy as np
+import pandas as pd
+import sqlite3 as sq
+from scipy import signal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path += [ROOT, os.path.join(ROOT, 'Analysis')]
+import epochTime as et
+import harmonicAnalysis as hx
+import highLowWater as hl
+import regressionModels as mdl
+import RWS_import_historic as imp
+from constants import names as NAMES
+
+
+# Amplitude (m) and phase (rad) of the constituents
+TIDE = {
+    'M2': (0.80, 1.0), 'S2': (0.20, 1.6), 'N2': (0.13, 0.7), 'K2': (0.05, 1.5),
+    'K1': (0.08, 2.9), 'O1': (0.10, 4.0), 'P1': (0.03, 2.8), 'M4': (0.10, 5.2),
+    'MS4': (0.06, 0.3), 'SA': (0.06, 3.9)}
+LUNAR = ['M2', 'N2', 'K2', 'K1', 'O1', 'M4', 'MS4']  # Nodally modulated
+NODAL_FACTOR = 0.037
+
+# Parameters of fullModel (m, years); time relative to TMEAN
+MSL = dict(p0 = 0.0, p1 = 0.0018, p2 = 4e-5, p3 = 1e-6,
+    Ac0 = 0.005, As0 = 0.002, Ac1 = 0.008, As1 = -0.004, t0 = 1993 - 1955)
+TMEAN = 1955
+
+SURGE = (0.95, 0.03)  # AR(1) coefficient per 10 minutes, innovation (m)
+NOISE = 0.01  # m
+
+PE = ['M2', 'S2', 'M4', 'SA', 'N2', 'O1', 'MS4']
+
+
+def station_names(n):
+    """
+    Names of n stations; the project stations first
+    """
+    return (list(NAMES) + [f'Station {i + 1}' for i in range(len(NAMES), n)])[:n]
+
+
+def _rng(name, salt = ''):
+    return np.random.default_rng(zlib.crc32((name + salt).encode()))
+
+
+def decimal_year(seconds):
+    """
+    Decimal year of epoch seconds (mean year length)
+    """
+    return 1970 + np.asarray(seconds, dtype = float) / (365.2425 * 86400)
+
+
+def mean_level(years, name = ''):
+    """
+    Mean sea level (m) from fullModel with a small offset per station
+    """
+    offset = _rng(name, 'msl').normal(0, 0.05)
+    return mdl.fullModel(np.asarray(years, dtype = float) - TMEAN, **MSL) + offset
+
+
+def water_levels(name, yr_start, yr_end, step = 600):
+    """
+    Synthetic water levels of a station
+
+    Args:
+        name, string: station name
+        yr_start, yr_end, int: first and last year
+        step, int: sampling interval (s)
+
+    Returns:
+        t, array: epoch seconds (int64)
+        h, array: water level (m)
+    """
+    t0 = np.datetime64(f'{yr_start}-01-01', 's').astype(np.int64)
+    t1 = np.datetime64(f'{yr_end + 1}-01-01', 's').astype(np.int64)
+    t = np.arange(t0, t1, step, dtype = np.int64)
+    yr = decimal_year(t)
+    rng = _rng(name)
+
+    h = mean_level(yr, name)
+
+    nodal = 1 + NODAL_FACTOR * np.cos(2 * np.pi * (yr - 1969.5) / 18.61)
+    days = t / 86400.
+    for c, f in zip(TIDE, hx.frequencies(list(TIDE))):
+        A, phi = TIDE[c]
+        amp = A * (nodal if c in LUNAR else 1) * rng.uniform(0.9, 1.1)
+        h += amp * np.cos(2 * np.pi * 24 * f * days - phi)
+
+    # AR(1) surge, filtered in blocks
+    a, s = SURGE
+    a_step = a ** (step / 600)
+    surge = np.empty(len(t))
+    zi = np.zeros(1)
+    for i in range(0, len(t), 1_000_000):
+        e = rng.normal(0, s, size = min(1_000_000, len(t) - i))
+        surge[i: i + len(e)], zi = signal.lfilter([1.], [1., -a_step], e, zi = zi)
+    h += surge + rng.normal(0, NOISE, size = len(t))
+    return t, h
+
+
+def high_low(t, h):
+    """
+    High and low waters of a series; soort 1 for high water, 2 for low
+    water as in the historic RWS files
+    """
+    idx, kind = hl.events(h)
+    return t[idx], h[idx], np.where(kind == hl.HIGH, 1, 2)
+
+
+def _rows(name, t, h, soort):
+    seconds = np.asarray(t)
+    tijd = seconds.astype('datetime64[s]').astype(str)
+    return pd.DataFrame({
+        'tijd': np.char.replace(tijd, 'T', ' '),
+        'waarde': np.round(100 * h),
+        'soort': soort,
+        'naam': name,
+        'bron': 'Synthetisch',
+        'grootheid': 'WATHTE',
+        'eenheid': 'cm',
+        'kwalico': 'Synthetisch',
+        'statuswaarde': 'Niet beschikbaar',
+        'meetapparaat': 999,
+        'bemonsteringsapparaat': 999,
+        'year': et.epoch_year(seconds),
+        'tepoch_dy': et.epoch_days(seconds),
+        'tepoch_s': seconds})[imp.COLUMNS]
+
+
+def write_observations(db, n_stations, yr_start, yr_end, step = 600, extremes = True):
+    """
+    Table RWS_Waterinfo with synthetic observations
+
+    Args:
+        db, string: path of the database; replaced if present
+        n_stations, int: number of stations
+        yr_start, yr_end, int: first and last year
+        step, int: sampling interval (s)
+        extremes, bool: add high and low waters as separate rows (soort
+            1 and 2) one year before the regular series starts
+
+    Returns:
+        number of rows
+    """
+    if os.path.exists(db):
+        os.remove(db)
+    cnxn = sq.connect(db)
+    imp.prepare_table(cnxn)
+
+    n = 0
+    with cnxn:
+        for nm in station_names(n_stations):
+            t, h = water_levels(nm, yr_start, yr_end, step = step)
+            n += imp.insert(cnxn, _rows(nm, t, h, None))
+            if extremes:
+                te, he, soort = high_low(*water_levels(nm, yr_start - 1, yr_start - 1, step = step))
+                n += imp.insert(cnxn, _rows(nm, te, he, soort))
+    imp.upgrade(cnxn)  # Indexes of the reader, as for a real database
+    cnxn.close()
+    return n
+
+
+def yearly_results(n_stations, yr_start, yr_end, const_set = 'PE'):
+    """
+    Table in the layout of const_yr: mean levels from the sea level model,
+    amplitudes with the nodal modulation
+    """
+    res = []
+    for nm in station_names(n_stations):
+        rng = _rng(nm, 'yearly')
+        years = np.arange(yr_start, yr_end + 1)
+        n = len(years)
+        z0 = mean_level(years + 0.5, nm) + rng.normal(0, 0.03, n)
+        nodal = 1 + NODAL_FACTOR * np.cos(2 * np.pi * (years + 0.5 - 1969.5) / 18.61)
+
+        df = pd.DataFrame({
+            'naam': nm, 'level_1': 0, 'z0': z0, 'zmean': z0 + rng.normal(0, 0.01, n),
+            'count': rng.choice([8760., 2920., 52560.], size = n),
+            'smean': rng.normal(0, 0.02, n), 'Rsq_adj': rng.uniform(0.9, 0.99, n),
+            'year': years, 'year_start': years, 'const_set': const_set})
+        for c in PE:
+            A = TIDE[c][0] * (nodal if c in LUNAR else 1)
+            df[f'{c}_ampl'] = A + rng.normal(0, 0.005, n)
+        res.append(df)
+    return pd.concat(res, ignore_index = True)
+
+
+def psmsl_levels(n_stations, yr_start, yr_end):
+    """
+    Table in the layout of utils.read_data_psmsl: annual mean levels per
+    station (upper case names), in m
+    """
+    res = []
+    for nm in station_names(n_stations):
+        years = np.arange(yr_start, yr_end + 1)
+        level = mean_level(years + 0.5, nm) + _rng(nm, 'psmsl').normal(0, 0.02, len(years))
+        res.append(pd.DataFrame({
+            'name': nm.upper(), 'time': years, 'level': level, 'type': 'rlr', 'freq': 'annual'}))
+    return pd.concat(res, ignore_index = True)
+
+
+def write_results(db, n_stations, yr_start, yr_end, sets = ('PE', )):
+    """
+    Table const_yr with synthetic yearly results and the index used by
+    utils.read_data_rws
+
+    Returns:
+        number of rows
+    """
+    if os.path.exists(db):
+        os.remove(db)
+    df = pd.concat(
+        [yearly_results(n_stations, yr_start, yr_end, s) for s in sets], ignore_index = True)
+    cnxn = sq.connect(db)
+    df.to_sql('const_yr', cnxn, index = False)
+    cnxn.execute(
+        "CREATE INDEX ix_const_yr_const_set_naam_year "
+        "ON 'const_yr' (const_set, naam, year)")
+    cnxn.commit()
+    cnxn.close()
+    return len(df)
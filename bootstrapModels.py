@@ -0,0 +1,179 @@
+"""
+Bootstrap uncertainty of trend and cycle parameters of the sea level models.
+
+Replicates are formed by resampling the residuals of the fitted model
+(independently, or in moving blocks to retain serial correlation) and
+adding them to the fitted values. For the linear models the pseudo-inverse
+of the design matrix is computed once per station and all replicates are
+solved as a single matrix product. The full model is solved per replicate
+by the profile over t0 (regressionModels.breakpoint_fit), optionally on a
+pool of processes.
+
+HVEC-lab, 2026
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import regressionModels as mdl
+
+
+# Parameter indices per model
+SLOPE = {mdl.model1: 1, mdl.model2: 1, mdl.model3a: 1, mdl.model3b: 1,
+    mdl.reducedModel: 1, mdl.fullModel: 1}
+ACCELERATION = {mdl.model2: (2, 2.), mdl.fullModel: (2, 1.)}  # index, factor
+CYCLES = {
+    mdl.model3a: {'A_885': (2, 3)},
+    mdl.model3b: {'A_1861': (2, 3)},
+    mdl.reducedModel: {'A_885': (2, 3), 'A_1861': (4, 5)},
+    mdl.fullModel: {'A_885': (4, 5), 'A_1861': (6, 7)},
+}
+
+
+def resample(resid, n_rep, block = None, seed = 0):
+    """
+    Resampled residuals (n, n_rep)
+
+    Args:
+        resid, array (n,): residuals of the fit
+        n_rep, int: number of replicates
+        block, int: block length of the moving-block bootstrap; None for
+            independent resampling; at most the number of residuals
+        seed, int: seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    n = len(resid)
+    if block is None or block <= 1:
+        return resid[rng.integers(0, n, size = (n, n_rep))]
+    if block > n:
+        raise ValueError(f'Block length {block} exceeds the number of residuals ({n})')
+
+    n_blocks = -(-n // block)
+    starts = rng.integers(0, n - block + 1, size = (n_blocks, n_rep))
+    idx = (starts[:, None, :] + np.arange(block)[None, :, None]).reshape(-1, n_rep)
+    return resid[idx[:n]]
+
+
+def quantities(model, P):
+    """
+    Slope, acceleration and cycle amplitudes from parameters (k[, m])
+    """
+    res = {}
+    if model in SLOPE:
+        res['slope'] = P[SLOPE[model]]
+    if model in ACCELERATION:
+        i, fac = ACCELERATION[model]
+        res['acceleration'] = fac * P[i]
+    for ky, (ic, js) in CYCLES.get(model, {}).items():
+        res[ky] = np.hypot(P[ic], P[js])
+    return res
+
+
+def bootstrap_linear(model, t, y, n_rep = 2000, block = None, seed = 0):
+    """
+    Bootstrap replicates of the parameters of a linear model
+
+    Args:
+        model, function: one of the linear models in regressionModels.DESIGN
+        t, array: time
+        y, array: observations of a single station
+        n_rep, int: number of replicates
+        block, int: block length; None for independent resampling
+        seed, int: seed of the random generator
+
+    Returns:
+        p, array (k,): fitted parameters
+        P, array (k, n_rep): replicates
+    """
+    t = np.asarray(t, dtype = float)
+    y = np.asarray(y, dtype = float)
+    X = mdl.design_matrix(model, t - t.mean())
+    pinv = np.linalg.pinv(X)
+
+    p = pinv @ y
+    fitted = X @ p
+    Ystar = fitted[:, None] + resample(y - fitted, n_rep, block = block, seed = seed)
+    return p, pinv @ Ystar
+
+
+def _breakpoint_chunk(args):
+    t, Y, t0_lo, t0_up = args
+    return mdl.breakpoint_fit(t, Y, t0_lo = t0_lo, t0_up = t0_up)['p']
+
+
+def bootstrap_full(t, y, n_rep = 500, block = None, seed = 0,
+        t0_lo = 1960, t0_up = 1995, workers = 1, chunk = 50):
+    """
+    Bootstrap replicates of the parameters of fullModel
+
+    Args:
+        t, array: time
+        y, array: observations of a single station
+        n_rep, int: number of replicates
+        block, int: block length; None for independent resampling
+        seed, int: seed of the random generator
+        t0_lo, t0_up, float: bounds of the breakpoint (years)
+        workers, int: number of worker processes; 1 solves in this process
+        chunk, int: replicates per work unit
+
+    Returns:
+        p, array (9,): fitted parameters
+        P, array (9, n_rep): replicates
+    """
+    t = np.asarray(t, dtype = float)
+    y = np.asarray(y, dtype = float)
+    fit = mdl.breakpoint_fit(t, y, t0_lo = t0_lo, t0_up = t0_up)
+    fitted = mdl.fullModel(t - fit['tmean'], *fit['p'])
+    Ystar = fitted[:, None] + resample(y - fitted, n_rep, block = block, seed = seed)
+
+    units = [
+        (t, Ystar[:, i: i + chunk], t0_lo, t0_up) for i in range(0, n_rep, chunk)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            parts = list(pool.map(_breakpoint_chunk, units))
+    else:
+        parts = [_breakpoint_chunk(unit) for unit in units]
+    return fit['p'], np.hstack(parts)
+
+
+def bootstrap_stations(df, model, var = 'z0', n_rep = 2000, block = None,
+        conf = 0.9, seed = 0, workers = 1):
+    """
+    Percentile intervals of slope, acceleration, A_885 and A_1861 for all
+    stations
+
+    Args:
+        df, dataframe: table as returned by utils.read_data_rws
+        model, function: linear model in regressionModels.DESIGN or fullModel
+        var, string: response variable
+        n_rep, int: number of replicates
+        block, int: block length; None for independent resampling
+        conf, float: confidence level of the interval
+        seed, int: seed of the random generator
+        workers, int: worker processes for fullModel
+
+    Returns:
+        dataframe with per station and quantity the estimate, bootstrap
+        standard deviation and interval bounds
+    """
+    q = [(1 - conf) / 2, 1 - (1 - conf) / 2]
+    rows = []
+    for nm, data in df.groupby('naam'):
+        data = data.dropna(subset = [var])
+        if model is mdl.fullModel:
+            p, P = bootstrap_full(
+                data['year'], data[var], n_rep = n_rep, block = block, seed = seed,
+                workers = workers)
+        else:
+            p, P = bootstrap_linear(
+                model, data['year'], data[var], n_rep = n_rep, block = block, seed = seed)
+
+        est = quantities(model, p)
+        for ky, rep in quantities(model, P).items():
+            lo, up = np.nanquantile(rep, q)
+            rows.append({
+                'name': nm, 'var': var, 'model': model.__name__, 'quantity': ky,
+                'estimate': est[ky], 'sd': np.nanstd(rep),
+                'lower': lo, 'upper': up})
+    return pd.DataFrame(rows)
@@ -7,8 +7,9 @@ HVEC lab, 2022
 import os
 
 
-PICTURES = r'C:\Users\Hessel Voortman\OneDrive - Hessel Voortman EC BV\20 Werk\2022_014 - ontwikkeling\JCHS_sea_level_North_Sea\Pics'
-RESULTS = r'C:\Users\Hessel Voortman\OneDrive - Hessel Voortman EC BV\20 Werk\2022_014 - ontwikkeling\JCHS_sea_level_North_Sea\Results'
+# Output folders; may be overridden by environment variables of the same name
+PICTURES = os.getenv('PICTURES', r'C:\Users\Hessel Voortman\OneDrive - Hessel Voortman EC BV\20 Werk\2022_014 - ontwikkeling\JCHS_sea_level_North_Sea\Pics')
+RESULTS = os.getenv('RESULTS', r'C:\Users\Hessel Voortman\OneDrive - Hessel Voortman EC BV\20 Werk\2022_014 - ontwikkeling\JCHS_sea_level_North_Sea\Results')
 
 YR_START = 1887
 YR_END = 2021
@@ -22,6 +23,16 @@ names = [
     'Vlissingen'
 ]
 
+# Tide gauge locations (latitude, longitude; degrees north, east), from PSMSL
+coordinates = {
+    'Delfzijl': (53.326, 6.933),
+    'Harlingen': (53.176, 5.409),
+    'Den Helder': (52.964, 4.745),
+    'IJmuiden': (52.462, 4.555),
+    'Hoek van Holland': (51.978, 4.120),
+    'Vlissingen': (51.442, 3.596),
+}
+
 Nmn = 2910
 
 figsize = (20, 24)
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Time handling of observations as int64 seconds since 1970-01-01.
+
+Observations carry their time stamp as integer epoch seconds (column
+tepoch_s of RWS_Waterinfo). All conversions below are vectorised numpy
+casts and arithmetic; no Python datetime objects are created:
+    epoch_seconds   text, datetime64 or datetime columns to epoch seconds
+    epoch_days      decimal days since 1970-01-01, the time unit of the
+                    tide analysis (run_utide_solve)
+    epoch_year      calendar year
+    year_start      epoch seconds of 1 January of a year, for range queries
+
+Times are in the time zone of the database; no conversion is applied.
+
+HVEC-lab, 2026
+"""
+
+import numpy as np
+
+
+DAY = 86400  # s
+
+
+def epoch_seconds(t):
+    """
+    Seconds since 1970-01-01 of time stamps; ISO text ('yyyy-mm-dd hh:mm:ss'),
+    datetime64 and pandas datetime columns are converted without parsing per
+    element, integers are taken as epoch seconds
+    """
+    t = np.asarray(t)
+    if np.issubdtype(t.dtype, np.integer):
+        return t.astype(np.int64)
+    if t.dtype == object or t.dtype.kind in 'US':
+        t = t.astype(str).astype('datetime64[s]')
+    return t.astype('datetime64[s]').astype(np.int64)
+
+
+def epoch_days(seconds):
+    """
+    Decimal days since 1970-01-01, the time unit of the tide analysis
+    """
+    return np.asarray(seconds, dtype = np.float64) / DAY
+
+
+def epoch_year(seconds):
+    """
+    Calendar year of epoch seconds
+    """
+    return np.asarray(seconds, dtype = np.int64).astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def year_start(yr):
+    """
+    Epoch seconds of 1 January 00:00 of a year (or array of years)
+    """
+    return (np.asarray(yr, dtype = np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[s]').astype(np.int64)
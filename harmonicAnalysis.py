@@ -0,0 +1,382 @@
+"""
+Batched harmonic analysis of water levels.
+
+Native least-squares alternative to hvec_tide.run_utide_solve for the short
+constituent lists of the yearly analysis. The sin/cos basis is evaluated
+once for the time grid of a station and the years are solved together in
+stacked linear algebra calls, BATCH years at a time to bound memory use.
+The robust mode follows the iteratively reweighted least squares of utide
+(Cauchy weights), so amplitudes and mean levels agree with method =
+'robust' within tolerance. As in the yearly
+analysis, no nodal corrections and no trend are applied.
+
+HVEC-lab, 2026
+"""
+
+import collections
+import numpy as np
+import pandas as pd
+from utide import ut_constants
+
+
+TUNE = 2.385  # Tuning constant of the Cauchy weight function in utide
+MAXIT = 50  # Iteration limit of the robust fit
+BATCH = 8  # Groups stacked at once; bounds memory use
+
+
+def frequencies(constit):
+    """
+    Frequencies of constituents in cycles per hour, from the utide tables
+    """
+    names = list(ut_constants.const.name)
+    return np.array([ut_constants.const.freq[names.index(c)] for c in constit])
+
+
+def basis(t, constit, tref = 0):
+    """
+    Design matrix [1, cos, sin] of the harmonic model
+
+    Args:
+        t, array: time in days
+        constit, list: constituent names
+        tref, float: reference time in days; does not affect amplitudes
+    """
+    t = np.asarray(t, dtype = float)
+    arg = 2 * np.pi * 24 * np.outer(t - tref, frequencies(constit))
+    return np.hstack([np.ones((len(t), 1)), np.cos(arg), np.sin(arg)])
+
+
+def stack(X, h, groups):
+    """
+    Arrange rows per group in zero-padded 3-D arrays
+
+    Returns:
+        labels, array (g,): group labels, sorted
+        Xs, array (g, n, p): design matrices
+        hs, array (g, n): observations
+        mask, array (g, n): True for rows holding data
+    """
+    labels, inv, counts = np.unique(groups, return_inverse = True, return_counts = True)
+    order = np.argsort(inv, kind = 'stable')
+    grp = inv[order]
+    pos = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    shape = (len(labels), counts.max())
+    Xs = np.zeros(shape + (X.shape[1],))
+    hs = np.zeros(shape)
+    mask = np.zeros(shape, dtype = bool)
+    Xs[grp, pos] = X[order]
+    hs[grp, pos] = np.asarray(h, dtype = float)[order]
+    mask[grp, pos] = True
+    return labels, Xs, hs, mask
+
+
+def batches(groups, batch = BATCH):
+    """
+    Rows of the groups in chunks of at most batch groups, so that only a few
+    groups are stacked and padded at a time
+
+    Returns:
+        list of (labels, idx, pos): group labels of the chunk, their rows
+        and the position of the group of every row within the chunk
+    """
+    labels, inv = np.unique(groups, return_inverse = True)
+    order = np.argsort(inv, kind = 'stable')
+    bounds = np.searchsorted(inv[order], np.arange(len(labels) + 1))
+    res = []
+    for i in range(0, len(labels), batch):
+        idx = order[bounds[i]: bounds[min(i + batch, len(labels))]]
+        res.append((labels[i: i + batch], idx, inv[idx] - i))
+    return res
+
+
+def wls(Xs, hs, w):
+    """
+    Stacked weighted least squares; rows and observations are multiplied by
+    the weights, as in utide.robustfit
+    """
+    Xw = w[:, :, None] * Xs
+    G = np.matmul(Xw.transpose(0, 2, 1), Xw)
+    rhs = np.matmul((w * hs)[:, None, :], Xw)[:, 0]
+    return np.matmul(np.linalg.pinv(G), rhs[:, :, None])[:, :, 0]
+
+
+def irls(Xs, hs, mask, tune = TUNE, tol = 1e-3, maxit = MAXIT, b0 = None):
+    """
+    Stacked robust fit, group by group equal to utide.robustfit with Cauchy
+    weights: leverage-corrected residuals scaled by the median absolute
+    deviation, stop when the relative reduction of the weighted mean square
+    residual drops below tol and fall back to the previous iteration when
+    the fit gets worse. A group of which the median absolute deviation is
+    zero cannot be reweighted; its iteration stops there and is reported as
+    not converged.
+
+    Args:
+        Xs, hs, mask: stacked data, see stack
+        tune, float: tuning constant of the weight function
+        tol, float: relative tolerance on the mean square residual
+        maxit, int: maximum number of iterations
+        b0, array (g, p): least-squares solution if already known (warm
+            start); saves the first solve without changing the result
+
+    Returns:
+        b, array (g, p): coefficients
+        iterations, array (g,): iterations used; maxit means not converged
+    """
+    ng = Xs.shape[0]
+    lev = (np.matmul(Xs, np.linalg.pinv(np.matmul(Xs.transpose(0, 2, 1), Xs))) * Xs).sum(axis = 2)
+    lev = np.where(mask, np.clip(lev, 0, 1 - 1e-12), 0)
+    rfac = 1 / (tune * np.sqrt(1 - lev))
+
+    w = mask.astype(float)
+    b = np.zeros((ng, Xs.shape[2]))
+    active = np.ones(ng, dtype = bool)
+    iterations = np.full(ng, maxit)
+
+    for i in range(maxit):
+        if i == 0 and b0 is not None:
+            b_new = b0
+        else:
+            b_new = wls(Xs, hs, w)
+        resid = hs - np.matmul(Xs, b_new[:, :, None])[:, :, 0]
+        rmeansq = ((w * resid)**2).sum(axis = 1) / w.sum(axis = 1)
+
+        if i > 0:
+            improvement = (old_rmeansq - rmeansq) / old_rmeansq
+
+            worse = active & (improvement < 0)
+            b[worse] = old_b[worse]
+            w[worse] = old_w[worse]
+            iterations[worse] = i
+            active &= ~worse
+
+            converged = active & (improvement < tol)
+            b[converged] = b_new[converged]
+            iterations[converged] = i + 1
+            active &= ~converged
+
+        b[active] = b_new[active]
+        if not active.any():
+            break
+
+        old_b, old_w, old_rmeansq = b.copy(), w.copy(), rmeansq
+
+        # Cauchy weights from normalised residuals
+        r = np.where(mask, resid, np.nan)
+        sigma = np.nanmedian(
+            np.abs(r - np.nanmedian(r, axis = 1, keepdims = True)),
+            axis = 1, keepdims = True) / 0.6745
+        degenerate = active & (sigma[:, 0] <= 0)
+        iterations[degenerate] = maxit
+        active &= ~degenerate
+        if not active.any():
+            break
+        rn = rfac * resid / np.where(sigma > 0, sigma, 1)
+        w[active] = np.where(mask, 1 / (1 + rn**2), 0)[active]
+
+    return b, iterations
+
+
+def summarise(b, Xs, hs, mask, constit):
+    """
+    Result fields as produced by hvec_tide.parse_utide: mean level from the
+    tide analysis, arithmetic mean, number of points, amplitudes and the
+    adjusted coefficient of determination
+    """
+    nc = len(constit)
+    n = mask.sum(axis = 1)
+    zmean = (hs * mask).sum(axis = 1) / n
+
+    resid = (hs - np.einsum('gnp,gp->gn', Xs, b)) * mask
+    sse = (resid**2).sum(axis = 1)
+    sst = (((hs - zmean[:, None]) * mask)**2).sum(axis = 1)
+    Rsq_adj = 1 - (sse / (n - 2 * nc - 1)) / (sst / (n - 1))
+
+    res = pd.DataFrame({'z0': b[:, 0], 'zmean': zmean, 'count': n.astype(np.int64)})
+    ampl = np.hypot(b[:, 1: nc + 1], b[:, nc + 1:])
+    for i, c in enumerate(constit):
+        res[f'{c}_ampl'] = ampl[:, i]
+    res['Rsq_adj'] = Rsq_adj
+    return res
+
+
+def solve_stacked(X, h, groups, constit, method = 'robust', batch = BATCH):
+    """
+    Harmonic analysis of every group (e.g. year) of a series in one go
+
+    Groups with fewer points than twice the number of parameters are
+    skipped, like failed analyses in the serial path. For the robust fit the
+    iterations per group are in res.attrs['iterations']. Groups are stacked
+    batch at a time.
+
+    Args:
+        X, array (n, p): design matrix, see basis
+        h, array (n,): water levels
+        groups, array (n,): group label per row
+        constit, list: constituent names, in the order of the basis
+        method, string: 'ols' or 'robust'
+        batch, int: groups stacked at once
+    """
+    groups = np.asarray(groups)
+    labels, counts = np.unique(groups, return_counts = True)
+    sel = np.flatnonzero(np.isin(groups, labels[counts >= 2 * X.shape[1]]))
+
+    res, iterations = [], []
+    for lab, idx, pos in batches(groups[sel], batch):
+        rows = sel[idx]
+        _, Xs, hs, mask = stack(X[rows], np.asarray(h)[rows], pos)
+        if method == 'robust':
+            b, it = irls(Xs, hs, mask)
+            iterations.append(it)
+        else:
+            b = wls(Xs, hs, mask.astype(float))
+
+        tmp = summarise(b, Xs, hs, mask, constit)
+        tmp.insert(0, 'group', lab)
+        res.append(tmp)
+
+    if not res:
+        # No group with enough points; empty table with the usual columns
+        empty = np.zeros((0, X.shape[1]))
+        res = [summarise(empty, empty[:, None], empty[:, :1], empty[:, :1] > 0, constit)]
+        res[0].insert(0, 'group', labels[:0])
+    res = pd.concat(res, ignore_index = True)
+    if method == 'robust':
+        res.attrs['iterations'] = np.concatenate(iterations or [np.zeros(0, dtype = int)])
+    return res
+
+
+def normal_blocks(X, h, groups, batch = BATCH):
+    """
+    Sufficient statistics of the least-squares problem per group (e.g. year)
+
+    Returns:
+        dict with labels (g,), XtX (g, p, p), Xty (g, p), yty (g,),
+        sy (g,) sum of observations and n (g,) number of observations
+    """
+    h = np.asarray(h, dtype = float)
+    res = collections.defaultdict(list)
+    for lab, idx, pos in batches(groups, batch):
+        _, Xs, hs, mask = stack(X[idx], h[idx], pos)
+        res['labels'].append(lab)
+        res['XtX'].append(np.matmul(Xs.transpose(0, 2, 1), Xs))
+        res['Xty'].append(np.einsum('gnp,gn->gp', Xs, hs))
+        res['yty'].append((hs**2).sum(axis = 1))
+        res['sy'].append(hs.sum(axis = 1))
+        res['n'].append(mask.sum(axis = 1))
+    return {ky: np.concatenate(val) for ky, val in res.items()}
+
+
+def window_sums(blocks, step):
+    """
+    Blocks of the trailing windows [yr - step, yr], formed by differences of
+    cumulative sums; the cost does not depend on the window length.
+
+    As in the serial analysis, the first step years are not used as window
+    end and windows are taken on year value, so missing years are allowed.
+    """
+    labels = blocks['labels']
+    first = labels.min()
+    pos = labels - first
+    ends = labels[step:]
+
+    res = {'labels': ends}
+    for ky in ['XtX', 'Xty', 'yty', 'sy', 'n']:
+        dense = np.zeros((labels.max() - first + 2,) + blocks[ky].shape[1:])
+        dense[pos + 1] = blocks[ky]
+        cs = np.cumsum(dense, axis = 0)
+        lo = np.maximum(ends - step - first, 0)
+        res[ky] = cs[ends - first + 1] - cs[lo]
+    return res
+
+
+def solve_blocks(blocks, constit):
+    """
+    Least-squares solution and result fields (see summarise) from summed
+    normal equations
+    """
+    nc = len(constit)
+    n = blocks['n']
+    b = np.einsum('gpq,gq->gp', np.linalg.pinv(blocks['XtX']), blocks['Xty'])
+
+    sse = (
+        blocks['yty'] - 2 * np.einsum('gp,gp->g', b, blocks['Xty'])
+        + np.einsum('gp,gpq,gq->g', b, blocks['XtX'], b))
+    sst = blocks['yty'] - blocks['sy']**2 / n
+    Rsq_adj = 1 - (sse / (n - 2 * nc - 1)) / (sst / (n - 1))
+
+    res = pd.DataFrame({'z0': b[:, 0], 'zmean': blocks['sy'] / n, 'count': n.astype(np.int64)})
+    ampl = np.hypot(b[:, 1: nc + 1], b[:, nc + 1:])
+    for i, c in enumerate(constit):
+        res[f'{c}_ampl'] = ampl[:, i]
+    res['Rsq_adj'] = Rsq_adj
+    return res, b
+
+
+def solve_windows(t, h, years, constit, steps = (0, ), method = 'ols', batch = BATCH):
+    """
+    Harmonic analysis of trailing multi-year windows of a single station for
+    several window lengths in one pass.
+
+    The least-squares solution follows from the per-year normal equations,
+    which are computed once. The robust solution runs the stacked IRLS on
+    the rows of each window, warm started with the least-squares solution.
+    Windows overlap when step > 0, so their rows are copied batch windows
+    at a time.
+
+    Args:
+        t, array: time in days
+        h, array: water levels
+        years, array: year per observation
+        constit, list: constituent names
+        steps, iterable: numbers of trailing years added to each window
+        method, string: 'ols' or 'robust'
+        batch, int: years or windows stacked at once
+    """
+    years = np.asarray(years)
+    h = np.asarray(h, dtype = float)
+    X = basis(t, constit, tref = np.mean(t))
+    blocks = normal_blocks(X, h, years, batch = batch)
+
+    res = []
+    for step in steps:
+        window = window_sums(blocks, step)
+        ok = window['n'] >= 2 * X.shape[1]
+        window = {ky: val[ok] for ky, val in window.items()}
+        tmp, b = solve_blocks(window, constit)
+
+        ends = window['labels']
+        if method == 'robust' and len(ends):
+            parts = []
+            for i in range(0, len(ends), batch):
+                rows = [
+                    np.flatnonzero((years >= yr - step) & (years <= yr))
+                    for yr in ends[i: i + batch]]
+                idx = np.concatenate(rows)
+                _, Xs, hs, mask = stack(
+                    X[idx], h[idx], np.repeat(np.arange(len(rows)), [len(r) for r in rows]))
+                bi, _ = irls(Xs, hs, mask, b0 = b[i: i + batch])
+                parts.append(summarise(bi, Xs, hs, mask, constit))
+            tmp = pd.concat(parts, ignore_index = True)
+
+        tmp['year'] = window['labels']
+        tmp['year_start'] = window['labels'] - step
+        res.append(tmp)
+
+    return pd.concat(res, ignore_index = True)
+
+
+def solve_years(t, h, years, constit, method = 'robust'):
+    """
+    Yearly harmonic analysis of a single station
+
+    Args:
+        t, array: time in days
+        h, array: water levels
+        years, array: year per observation
+        constit, list: constituent names
+        method, string: 'ols' or 'robust'
+    """
+    X = basis(t, constit, tref = np.mean(t))
+    res = solve_stacked(X, h, years, constit, method = method)
+    return res.rename(columns = {'group': 'year'})
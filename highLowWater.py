@@ -0,0 +1,148 @@
+"""
+Streaming extraction of high and low waters.
+
+High and low waters are the peaks and troughs found by scipy.signal.find_peaks
+with a minimum horizontal distance, as in set_high_low_column of Section 4b.
+Long series (10-minute or 1-minute data over a century) are processed in
+chunks with an overlap on both sides; only the events in the core of a chunk
+are kept. With an overlap of several times the peak distance the events are
+the same as those of a single call on the full series, while only a chunk is
+held in memory. Sources are the memory-mapped arrays of observationCache.
+
+Events are stored per station as compact arrays:
+    time.npy   int64, seconds since 1970-01-01
+    level.npy  float32, water level in m
+    type.npy   int8, HIGH or LOW
+
+HVEC-lab, 2026
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+from scipy import signal
+
+import observationCache as oc
+
+
+HIGH, LOW = 1, -1
+
+DISTANCE = 50  # Horizontal distance between peaks in samples, as in Section 4b
+CHUNK = 500_000  # Samples per chunk
+
+
+def peaks(h, sign = HIGH, distance = DISTANCE, chunk = CHUNK, margin = None):
+    """
+    Indices of peaks (or troughs) of a series, found chunk by chunk
+
+    Args:
+        h, array: series; may be memory-mapped
+        sign, int: HIGH for peaks, LOW for troughs
+        distance, int: minimum horizontal distance between peaks (samples)
+        chunk, int: samples per chunk
+        margin, int: overlap on either side of a chunk; default ten times
+            the distance
+
+    Returns:
+        array of indices, sorted
+    """
+    if margin is None:
+        margin = 10 * distance
+
+    n = len(h)
+    res = []
+    for start in range(0, n, chunk):
+        lo = max(start - margin, 0)
+        hi = min(start + chunk + margin, n)
+        seg = sign * np.asarray(h[lo: hi], dtype = float)
+        ids = signal.find_peaks(seg, distance = distance)[0] + lo
+        res.append(ids[(ids >= start) & (ids < start + chunk)])
+    return np.concatenate(res) if res else np.empty(0, dtype = np.int64)
+
+
+def events(h, distance = DISTANCE, chunk = CHUNK, margin = None):
+    """
+    Indices and type of high and low waters, sorted in time
+    """
+    hw = peaks(h, HIGH, distance = distance, chunk = chunk, margin = margin)
+    lw = peaks(h, LOW, distance = distance, chunk = chunk, margin = margin)
+
+    idx = np.concatenate([hw, lw])
+    kind = np.concatenate([
+        np.full(len(hw), HIGH, dtype = np.int8), np.full(len(lw), LOW, dtype = np.int8)])
+    order = np.argsort(idx, kind = 'stable')
+    return idx[order], kind[order]
+
+
+def flags(h, distance = DISTANCE, chunk = CHUNK, margin = None):
+    """
+    Boolean per sample, True for high and low waters; replaces the column
+    'High and low' of Section 4b
+    """
+    idx, _ = events(h, distance = distance, chunk = chunk, margin = margin)
+    res = np.zeros(len(h), dtype = bool)
+    res[idx] = True
+    return res
+
+
+def extract(cache, name, distance = DISTANCE, chunk = CHUNK):
+    """
+    High and low waters of a station in the observation cache
+
+    Args:
+        cache, ObservationCache: source of the observations
+        name, string: station name
+        distance, int: minimum horizontal distance between peaks (samples)
+        chunk, int: samples per chunk
+
+    Returns:
+        time (int64, s), level (float32, m) and type (int8) of the events
+    """
+    t, h = cache.station(name)
+    idx, kind = events(h, distance = distance, chunk = chunk)
+    return np.asarray(t[idx]), np.asarray(h[idx]), kind
+
+
+def export(cache, root, names = None, distance = DISTANCE, chunk = CHUNK):
+    """
+    Write the high and low waters of all (or selected) stations
+
+    Args:
+        cache, ObservationCache: source of the observations
+        root, string: output directory; replaced if present
+        names, list: stations; default all stations in the cache
+        distance, int: minimum horizontal distance between peaks (samples)
+        chunk, int: samples per chunk
+    """
+    if names is None:
+        names = cache.stations
+
+    tmp = root + '.tmp'
+    shutil.rmtree(tmp, ignore_errors = True)
+    os.makedirs(tmp)
+
+    for nm in names:
+        t, h, kind = extract(cache, nm, distance = distance, chunk = chunk)
+        folder = os.path.join(tmp, nm)
+        os.makedirs(folder)
+        np.save(os.path.join(folder, 'time.npy'), t)
+        np.save(os.path.join(folder, 'level.npy'), h)
+        np.save(os.path.join(folder, 'type.npy'), kind)
+        print(nm, len(t))
+
+    manifest = {
+        'source': os.path.abspath(cache.root), 'distance': distance,
+        'stations': list(names)}
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+    shutil.rmtree(root, ignore_errors = True)
+    os.rename(tmp, root)
+    return
+
+
+#================= main ===================
+if __name__ == '__main__':
+    dir = os.getenv('DATAPATH')
+    export(oc.ObservationCache(dir + 'RWS_cache'), dir + 'RWS_high_low')
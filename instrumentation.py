@@ -0,0 +1,232 @@
+"""
+Timing and memory instrumentation of processing stages.
+
+A Recorder writes one JSON object per line for every span (stage with wall
+clock and CPU time, resident memory and peak resident memory) and every
+event (e.g. a solver call with its iteration count). The module-level
+recorder is a no-op until enable() is called, so instrumented code costs
+nothing in normal use. summary() turns a log into a table per stage.
+
+Memory is read through psutil when installed, otherwise from /proc and the
+resource module (Linux, macOS); without either it is reported as null.
+
+HVEC-lab, 2026
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def rss():
+    """
+    Resident memory of this process (MB)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process (MB)
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2**20
+    return None
+
+
+class Recorder:
+    """
+    Writes spans and events as JSON lines
+
+    Args:
+        file, string: output file; None keeps records in memory only
+        run, string: label of the run, added to every record
+    """
+
+    def __init__(self, file = None, run = None):
+        self.file = file
+        self.run = run or time.strftime('%Y%m%dT%H%M%S')
+        self.records = []
+        self._f = open(file, 'a', encoding = 'utf-8') if file else None
+
+    def event(self, kind, **fields):
+        """
+        Record a single event
+        """
+        rec = {'run': self.run, 'kind': kind, 'time': time.time(), **fields}
+        self.records.append(rec)
+        if self._f:
+            self._f.write(json.dumps(rec, default = _plain) + '\n')
+            self._f.flush()
+        return rec
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        """
+        Time a stage; extra fields can be added to the yielded dict
+        """
+        extra = {}
+        t0, c0, m0 = time.perf_counter(), time.process_time(), rss()
+        try:
+            yield extra
+        finally:
+            self.event(
+                'span', stage = stage, **labels, **extra,
+                seconds = time.perf_counter() - t0, cpu = time.process_time() - c0,
+                rss_start = m0, rss = rss(), peak_rss = peak_rss())
+
+    def iterate(self, iterable, stage, labels = None):
+        """
+        Generator recording the time spent producing every item, e.g. the
+        reads of a streaming source
+
+        Args:
+            iterable, iterable: source
+            stage, string: stage name
+            labels, function: item -> dict of labels
+        """
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.event(
+                'span', stage = stage, **(labels(item) if labels else {}),
+                seconds = time.perf_counter() - t0, rss = rss())
+            yield item
+
+    def close(self):
+        if self._f:
+            self._f.close()
+            self._f = None
+        return
+
+
+class _Null(Recorder):
+    """
+    Recorder doing nothing
+    """
+
+    def __init__(self):
+        self.run, self.records, self._f = None, [], None
+
+    def event(self, kind, **fields):
+        return None
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        yield {}
+
+    def iterate(self, iterable, stage, labels = None):
+        return iterable
+
+
+recorder = _Null()
+
+
+def enable(file, run = None):
+    """
+    Replace the module recorder by one writing to file
+    """
+    global recorder
+    recorder.close()
+    recorder = Recorder(file, run = run)
+    return recorder
+
+
+def span(stage, **labels):
+    """
+    Span of the module recorder
+    """
+    return recorder.span(stage, **labels)
+
+
+def event(kind, **fields):
+    """
+    Event of the module recorder
+    """
+    return recorder.event(kind, **fields)
+
+
+def iterate(iterable, stage, labels = None):
+    """
+    Timed iteration of the module recorder, see Recorder.iterate
+    """
+    return recorder.iterate(iterable, stage, labels = labels)
+
+
+def timed(stage):
+    """
+    Decorator recording a span for every call of a function
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _plain(x):
+    if hasattr(x, 'item'):
+        return x.item()
+    return str(x)
+
+
+def read(file):
+    """
+    Records of a JSON lines file as a dataframe
+    """
+    with open(file, encoding = 'utf-8') as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summary(records, by = 'stage'):
+    """
+    Table per stage: number of spans, total, mean, 95th percentile and
+    maximum time (s) and the maximum peak memory (MB)
+
+    Args:
+        records, dataframe or string: records or JSON lines file
+        by, string or list: grouping columns
+    """
+    if isinstance(records, str):
+        records = read(records)
+    spans = records[records['kind'] == 'span']
+    if 'peak_rss' not in spans:
+        spans = spans.assign(peak_rss = float('nan'))
+    res = spans.groupby(by).agg(
+        count = ('seconds', 'size'),
+        total_s = ('seconds', 'sum'),
+        mean_s = ('seconds', 'mean'),
+        p95_s = ('seconds', lambda x: x.quantile(0.95)),
+        max_s = ('seconds', 'max'),
+        peak_MB = ('peak_rss', 'max'))
+    return res.sort_values('total_s', ascending = False)
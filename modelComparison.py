@@ -0,0 +1,161 @@
+"""
+Model comparison of sea level models in a single pass.
+
+Every candidate model is fitted once per station, variable and year range;
+fitted values, residuals and degrees of freedom are kept in a cache from
+which the F-tests, information criteria, the parameter table and the plot
+curves of Sections 5a/5b are derived. Linear models are fitted for all
+stations at once (regressionModels.linear_fit), the full model by the
+profile over t0 (regressionModels.breakpoint_fit).
+
+HVEC-lab, 2026
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stat
+
+import regressionModels as mdl
+
+
+CANDIDATES = [
+    mdl.model1, mdl.model2, mdl.model3a, mdl.model3b, mdl.reducedModel, mdl.fullModel]
+
+LABELS = {
+    mdl.model1: 'Model 1',
+    mdl.model2: 'Model 2',
+    mdl.model3a: 'Model 3a',
+    mdl.model3b: 'Model 3b',
+    mdl.reducedModel: 'Reduced',
+    mdl.fullModel: 'Full',
+}
+
+# Nested pairs (reduced, full) for F-tests
+NESTED = [
+    (mdl.model1, mdl.model2),
+    (mdl.model1, mdl.model3a),
+    (mdl.model1, mdl.model3b),
+    (mdl.model3a, mdl.reducedModel),
+    (mdl.model3b, mdl.reducedModel),
+    (mdl.reducedModel, mdl.fullModel),
+]
+
+
+def fit_all(df, vars, yr_start, yr_end, models = CANDIDATES, t0_lo = 1960, t0_up = 1995):
+    """
+    Fit every candidate model once per station and variable
+
+    Args:
+        df, dataframe: table as returned by utils.read_data_rws
+        vars, list: response variables
+        yr_start, yr_end, int: year range
+        models, list: candidate models
+        t0_lo, t0_up, float: bounds of the breakpoint of the full model
+
+    Returns:
+        dict keyed by (name, var, model label) holding t, y, p, tmean,
+        ymodel, resid, n, k, dof, sse and Rsqadj
+    """
+    data = df[df['year'].between(yr_start, yr_end)]
+    wide = data.pivot_table(index = 'year', columns = 'naam', values = vars)
+    t = wide.index.to_numpy(dtype = float)
+    Y = wide.to_numpy(dtype = float)
+
+    cache = {}
+    for model in models:
+        if model is mdl.fullModel:
+            res = mdl.breakpoint_fit(t, Y, t0_lo = t0_lo, t0_up = t0_up)
+        else:
+            res = mdl.linear_fit(model, t, Y)
+
+        for j, (vr, nm) in enumerate(wide.columns):
+            rows = ~np.isnan(Y[:, j])
+            p = res['p'][:, j]
+            ymodel = model(t[rows] - res['tmean'][j], *p)
+            resid = Y[rows, j] - ymodel
+            n, k = rows.sum(), len(p)
+            cache[(nm, vr, LABELS[model])] = {
+                't': t[rows], 'y': Y[rows, j], 'p': p, 'tmean': res['tmean'][j],
+                'ymodel': ymodel, 'resid': resid, 'n': n, 'k': k, 'dof': n - k,
+                'sse': (resid**2).sum(), 'Rsqadj': res['Rsqadj'][j],
+                'sigma': res.get('sigma', np.full((k, Y.shape[1]), np.nan))[:, j],
+                'model': model}
+    return cache
+
+
+def ftests(cache, pairs = NESTED, alpha = 0.05):
+    """
+    F-tests of nested model pairs from the cached fits
+
+    Returns:
+        dataframe per station, variable and pair with F, p-value and the
+        decision to reject the reduced model
+    """
+    rows = []
+    for (nm, vr, label), full in cache.items():
+        for red_model, full_model in pairs:
+            if label != LABELS[full_model] or (nm, vr, LABELS[red_model]) not in cache:
+                continue
+            red = cache[(nm, vr, LABELS[red_model])]
+            F = ((red['sse'] - full['sse']) / (full['k'] - red['k'])) / (full['sse'] / full['dof'])
+            pval = stat.f.sf(F, full['k'] - red['k'], full['dof'])
+            rows.append({
+                'name': nm, 'var': vr, 'reduced': LABELS[red_model], 'full': label,
+                'F': F, 'p-value': pval, 'reject': pval < alpha})
+    return pd.DataFrame(rows)
+
+
+def information_criteria(cache):
+    """
+    AIC and BIC (Gaussian likelihood) of every cached fit
+    """
+    rows = []
+    for (nm, vr, label), fit in cache.items():
+        n, k = fit['n'], fit['k']
+        ll = n * np.log(fit['sse'] / n)
+        rows.append({
+            'name': nm, 'var': vr, 'model': label,
+            'AIC': ll + 2 * k, 'BIC': ll + k * np.log(n), 'Rsqadj': fit['Rsqadj']})
+    return pd.DataFrame(rows)
+
+
+def parameter_table(cache, conf = 0.9):
+    """
+    Parameter table in the layout of Sections 5a/5b (SI units; conversion
+    to publication units is left to the notebook)
+    """
+    k = stat.norm.ppf(1 - (1 - conf) / 2)
+    rows = []
+    for (nm, vr, label), fit in cache.items():
+        model, p = fit['model'], fit['p']
+        row = {'name': nm, 'var': vr, 'model': label, 'intercept': p[0],
+            'Rsqadj': fit['Rsqadj']}
+        if model is not mdl.harmonic and len(p) > 1:
+            row['slope'] = p[1]
+            row['sigma_slope'] = fit['sigma'][1]
+            row['90%_band_slope'] = k * fit['sigma'][1]
+        if model is mdl.model2:
+            row['acceleration'] = 2 * p[2]
+        if model is mdl.fullModel:
+            row['acceleration'] = p[2]
+            row['jerk'] = p[3]
+            row['A_885'] = np.hypot(p[4], p[5])
+            row['A_1861'] = np.hypot(p[6], p[7])
+            row['t0'] = p[8] + fit['tmean']
+        if model is mdl.reducedModel:
+            row['A_885'] = np.hypot(p[2], p[3])
+            row['A_1861'] = np.hypot(p[4], p[5])
+        if model is mdl.model3a:
+            row['A_885'] = np.hypot(p[2], p[3])
+        if model is mdl.model3b:
+            row['A_1861'] = np.hypot(p[2], p[3])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def curve(cache, name, var, label, xgr):
+    """
+    Fitted model evaluated on a plotting grid (years)
+    """
+    fit = cache[(name, var, label)]
+    return fit['model'](np.asarray(xgr, dtype = float) - fit['tmean'], *fit['p'])
@@ -0,0 +1,177 @@
+"""
+Station values of the gridded nodal datasets of Section 6c.
+
+The grids of Frederikse et al. (2016) and Steffelbauer et al. (2022) hold
+the amplitude of the 18.61-year nodal cycle in relative sea level on a
+global 0.5 degree grid, with longitude (0 to 360 east) on x and latitude on
+y. All stations are interpolated in a single vectorised call per grid. The
+grid is opened lazily and only the region around the stations is read.
+
+Extracted values are kept in a JSON file per grid in the cache folder of
+the pipeline (PIPELINE_CACHE, default .pipeline), together with the
+checksum of the grid; they are reused for as long as the checksum matches,
+so repeated look-ups do not open the grid at all. The Data folder is not
+written to.
+
+HVEC-lab, 2026
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from constants import coordinates
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE = os.path.join(os.getenv('PIPELINE_CACHE', os.path.join(ROOT, '.pipeline')), 'nodalGrids')
+
+# Dataset: file, variable
+GRIDS = {
+    'Frederikse': (os.path.join(ROOT, 'Data', 'frederikse_2016_nodal_rsl.grd'), 'RSL'),
+    'Steffelbauer': (os.path.join(ROOT, 'Data', 'Steffelbauer_2022_nodal.nc'), 'rsl_eq'),
+}
+
+
+def checksum(file):
+    """
+    SHA-1 of the contents of a file
+    """
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def interpolate(file, variable, lat, lon, method = 'linear'):
+    """
+    Values of a grid at a number of points in one interpolation call
+
+    Args:
+        file, string: netCDF grid with coordinates x (longitude) and y
+            (latitude)
+        variable, string: variable of the grid
+        lat, lon, arrays: coordinates of the points (degrees)
+        method, string: interpolation method of xarray
+
+    Returns:
+        array of values at the points
+    """
+    import xarray as xr
+
+    lon = np.mod(np.asarray(lon, dtype = float), 360)
+    lat = np.asarray(lat, dtype = float)
+    with xr.open_dataset(file) as ds:
+        # Pointwise indexers; for linear interpolation xarray first reduces
+        # the lazy grid to the box around the points, so only that is read
+        res = ds[variable].interp(
+            x = xr.DataArray(lon, dims = 'point'),
+            y = xr.DataArray(lat, dims = 'point'), method = method)
+        return res.to_numpy()
+
+
+def _cache_file(file, variable):
+    return os.path.join(CACHE, f'{os.path.basename(file)}.{variable}.json')
+
+
+def _read_cache(file, variable):
+    """
+    Cached points of a grid; empty when the grid changed
+    """
+    path = _cache_file(file, variable)
+    st = os.stat(file)
+    if not os.path.exists(path):
+        return {'checksum': checksum(file), 'mtime': st.st_mtime_ns, 'size': st.st_size, 'points': {}}
+
+    with open(path) as f:
+        cache = json.load(f)
+    if (cache['mtime'], cache['size']) != (st.st_mtime_ns, st.st_size):
+        # Touched; the contents decide
+        sha = checksum(file)
+        if sha != cache['checksum']:
+            cache['points'] = {}
+        cache.update(checksum = sha, mtime = st.st_mtime_ns, size = st.st_size)
+    return cache
+
+
+def _key(lat, lon):
+    return f'{lat:.4f},{lon:.4f}'
+
+
+def extract(file, variable, lat, lon):
+    """
+    Values of a grid at a number of points; points not in the cache are
+    interpolated at once and added to it
+
+    Args:
+        file, string: netCDF grid
+        variable, string: variable of the grid
+        lat, lon, arrays: coordinates of the points (degrees)
+
+    Returns:
+        array of values at the points
+    """
+    cache = _read_cache(file, variable)
+    points = cache['points']
+    keys = [_key(a, b) for a, b in zip(lat, lon)]
+
+    new = [i for i, ky in enumerate(keys) if ky not in points]
+    if new:
+        values = interpolate(file, variable, np.take(lat, new), np.take(lon, new))
+        points.update({keys[i]: float(v) for i, v in zip(new, values)})
+        os.makedirs(CACHE, exist_ok = True)
+        tmp = _cache_file(file, variable) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent = 1)
+        os.replace(tmp, _cache_file(file, variable))
+
+    return np.array([points[ky] for ky in keys], dtype = float)
+
+
+def station_values(stations = None, grids = GRIDS):
+    """
+    Nodal amplitude of all gridded datasets at the stations
+
+    Args:
+        stations, dict: name: (latitude, longitude); default the tide
+            gauges in constants
+        grids, dict: dataset: (file, variable)
+
+    Returns:
+        dataframe with name, lat, lon and a column per dataset (units of
+        the grid)
+    """
+    stations = coordinates if stations is None else stations
+    lat, lon = np.array(list(stations.values()), dtype = float).reshape(-1, 2).T
+
+    res = pd.DataFrame({'name': list(stations), 'lat': lat, 'lon': lon})
+    for nm, (file, variable) in grids.items():
+        res[nm] = extract(file, variable, lat, lon)
+    return res
+
+
+def compare(param, stations = None, grids = GRIDS, model = 'Reduced'):
+    """
+    Observed amplitude of the nodal cycle against the gridded datasets
+
+    Args:
+        param, dataframe: parameter table in publication units (A_1861 in
+            mm), see modelComparison.parameter_table
+        stations, dict: name: (latitude, longitude); default the tide
+            gauges in constants
+        grids, dict: dataset: (file, variable)
+        model, string: model of which A_1861 is taken
+
+    Returns:
+        dataframe per station with the observed A_1861, the magnitude of
+        the amplitude per dataset and the difference with the observation
+    """
+    obs = param.loc[param['model'] == model, ['name', 'A_1861']]
+    res = station_values(stations, grids).merge(obs, on = 'name', how = 'left')
+    for nm in grids:
+        res[nm] = res[nm].abs()
+        res[f'{nm}_diff'] = res['A_1861'] - res[nm]
+    return res
@@ -0,0 +1,165 @@
+"""
+Columnar cache of observed water levels.
+
+One-time export of the WATHTE rows of RWS_Waterinfo to a directory per
+station with time-sorted arrays:
+    time.npy     int64, seconds since 1970-01-01 (time zone of the database)
+    level.npy    float32, water level in m
+    years.npy    int64, years present
+    offsets.npy  int64, start of each year in time/level; one extra entry
+                 holding the total length
+
+The arrays are opened memory-mapped, so a station-year is a zero-copy slice
+and only the data actually used is loaded.
+
+HVEC-lab, 2026
+"""
+
+import json
+import os
+import shutil
+import sqlite3 as sq
+import numpy as np
+
+from epochTime import epoch_year
+
+
+# Stations combined under a single name: IJmuiden Noordersluis misses data,
+# the differences with Buitenhaven (also spelled buitenhaven) are negligible
+ALIASES = {
+    'IJmuiden': (
+        'IJmuiden Noordersluis', 'IJmuiden buitenhaven', 'IJmuiden Buitenhaven'),
+}
+
+CHUNK = 1_000_000  # Rows fetched from the database at once
+
+
+def _fetch(cnxn, names):
+    """
+    Time (s) and level (m) of stations, sorted on time; of double times the
+    first stored row is kept, as in RWS_reader
+    """
+    sql = (
+        "SELECT tepoch_s, waarde FROM 'RWS_Waterinfo' "
+        f"WHERE naam IN ({', '.join('?' * len(names))}) AND grootheid = 'WATHTE' "
+        "ORDER BY tepoch_s, rowid"
+    )
+    crsr = cnxn.execute(sql, names)
+    t, h = [], []
+    while True:
+        rows = crsr.fetchmany(CHUNK)
+        if not rows:
+            break
+        ti, hi = zip(*rows)
+        t.append(np.array(ti, dtype = np.int64))
+        h.append(np.array(hi, dtype = np.float64))
+
+    t = np.concatenate(t) if t else np.empty(0, dtype = np.int64)
+    h = (np.concatenate(h) / 100).astype(np.float32) if h else np.empty(0, dtype = np.float32)
+
+    t, idx = np.unique(t, return_index = True)  # Sorted, lowest rowid of doubles kept
+    return t, h[idx]
+
+
+def export(db, root, names = None, aliases = ALIASES):
+    """
+    Write the cache for all (or selected) stations
+
+    Args:
+        db, string: path of RWS_data.db
+        root, string: cache directory; replaced if present
+        names, list: stations to export; default all WATHTE stations
+        aliases, dict: combined stations, name: tuple of source names
+    """
+    cnxn = sq.connect(db)
+    if names is None:
+        sql = "SELECT DISTINCT naam FROM 'RWS_Waterinfo' WHERE grootheid = 'WATHTE'"
+        names = [row[0] for row in cnxn.execute(sql)]
+
+    stations = {nm: (nm, ) for nm in names}
+    stations.update(aliases)
+
+    tmp = root + '.tmp'
+    shutil.rmtree(tmp, ignore_errors = True)
+    os.makedirs(tmp)
+
+    for nm, sources in stations.items():
+        t, h = _fetch(cnxn, sources)
+        if len(t) == 0:
+            continue
+        yr = epoch_year(t)
+        years = np.unique(yr)
+        offsets = np.append(np.searchsorted(yr, years), len(yr))
+
+        folder = os.path.join(tmp, nm)
+        os.makedirs(folder)
+        np.save(os.path.join(folder, 'time.npy'), t)
+        np.save(os.path.join(folder, 'level.npy'), h)
+        np.save(os.path.join(folder, 'years.npy'), years)
+        np.save(os.path.join(folder, 'offsets.npy'), offsets.astype(np.int64))
+        print(nm, len(t))
+
+    cnxn.close()
+    manifest = {'source': os.path.abspath(db), 'stations': sorted(os.listdir(tmp))}
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+    shutil.rmtree(root, ignore_errors = True)
+    os.rename(tmp, root)
+    return
+
+
+class ObservationCache:
+    """
+    Read access to an exported cache; arrays are memory-mapped
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'manifest.json')) as f:
+            self.stations = json.load(f)['stations']
+        self._open = {}
+
+    def _arrays(self, name):
+        if name not in self._open:
+            folder = os.path.join(self.root, name)
+            self._open[name] = {
+                ky: np.load(os.path.join(folder, ky + '.npy'), mmap_mode = 'r')
+                for ky in ['time', 'level', 'years', 'offsets']}
+        return self._open[name]
+
+    def years(self, name):
+        """
+        Years with data of a station
+        """
+        return np.asarray(self._arrays(name)['years'])
+
+    def station(self, name):
+        """
+        Time (epoch seconds) and level (m) of a full station record
+        """
+        arr = self._arrays(name)
+        return arr['time'], arr['level']
+
+    def window(self, name, first, last):
+        """
+        Zero-copy views of time and level for the years first up to and
+        including last
+        """
+        arr = self._arrays(name)
+        years, offsets = arr['years'], arr['offsets']
+        i0 = offsets[np.searchsorted(years, first, side = 'left')]
+        i1 = offsets[np.searchsorted(years, last, side = 'right')]
+        return arr['time'][i0: i1], arr['level'][i0: i1]
+
+    def year(self, name, yr):
+        """
+        Zero-copy views of time and level of a single station-year
+        """
+        return self.window(name, yr, yr)
+
+
+#================= main ===================
+if __name__ == '__main__':
+    dir = os.getenv('DATAPATH')
+    export(dir + 'RWS_data.db', dir + 'RWS_cache')
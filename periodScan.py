@@ -0,0 +1,125 @@
+"""
+Scan for long-period cycles in the yearly series.
+
+The models of regressionModels include the 8.85 and 18.61 year cycles with
+fixed periods (regressionModels.T). To find out whether other long-period
+signals are present, a fine grid of candidate periods is evaluated here in
+the style of the generalised Lomb-Scargle periodogram: for every period a
+sine and cosine are fitted jointly with the linear trend (regressionModels.
+model1) to every station and variable at once.
+
+The trend is projected out once per series; per period only sums of
+products of the sine and cosine columns are needed, which are evaluated for
+all periods and series with a few matrix products. Missing years are
+handled by weights of 0 and 1 as in startYearSweep.
+
+HVEC-lab, 2026
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+import regressionModels as mdl
+
+
+def periods(lo = 2., hi = 40., n = 2000):
+    """
+    Candidate periods (years), evenly spaced in frequency
+    """
+    return 1 / np.linspace(1 / hi, 1 / lo, n)[::-1]
+
+
+def scan(df, vars = ['z0'], T = None, yr_start = None, yr_end = 2021):
+    """
+    Periodogram with a linear trend for all stations and variables
+
+    Args:
+        df, dataframe: table as returned by utils.read_data_rws
+        vars, list: response variables, e.g. ['z0', 'M2', 'S2']
+        T, array: candidate periods (years); default periods()
+        yr_start, yr_end, int: year range; default all years up to 2021
+
+    Returns:
+        table, dataframe: per station, variable and period the power (part
+            of the variance around the trend explained by the cycle) and
+            the amplitude of the cycle
+        grid, dict: names, vars, period and per quantity an array
+            (series, period) with series ordered as (name, var)
+    """
+    T = periods() if T is None else np.asarray(T, dtype = float)
+    data = df[df['year'] <= yr_end]
+    if yr_start is not None:
+        data = data[data['year'] >= yr_start]
+    wide = data.pivot_table(index = 'year', columns = ['naam'], values = vars)
+    wide = wide.reorder_levels([1, 0], axis = 1).sort_index(axis = 1)
+    series = wide.columns.to_list()
+
+    years = wide.index.to_numpy(dtype = float)
+    t = years - years.mean()
+    Y = wide.to_numpy(dtype = float)
+    W = (~np.isnan(Y)).astype(float)  # Availability per year and series
+    Y = np.nan_to_num(Y)
+
+    # Trend per series, projected out once
+    X = mdl.design_matrix(mdl.model1, t)
+    A = np.einsum('ns,ni,nj->sij', W, X, X)
+    Ainv = np.linalg.inv(A)
+    p = np.einsum('sij,sj->si', Ainv, (W * Y).T @ X)
+    R = W * (Y - X @ p.T)  # Residuals of the trend; 0 for missing years
+    sse0 = (R**2).sum(axis = 0)
+
+    # Sine and cosine of all periods
+    arg = np.outer(t, 2 * np.pi / T)
+    C, S = np.cos(arg), np.sin(arg)
+
+    # Weighted trend columns of all series side by side
+    WX = (W[:, :, None] * X[:, None, :]).reshape(len(t), -1)
+    k = X.shape[1]
+
+    def trend_part(U, V):
+        """
+        Weighted products of the trend components of U and V per series
+        and period
+        """
+        XU = (WX.T @ U).reshape(-1, k, len(T))
+        XV = XU if V is U else (WX.T @ V).reshape(-1, k, len(T))
+        return (XU * np.einsum('sij,sjm->sim', Ainv, XV)).sum(axis = 1)
+
+    # Normal equations of (cos, sin) orthogonal to the trend
+    CC = W.T @ C**2 - trend_part(C, C)
+    SS = W.T @ S**2 - trend_part(S, S)
+    CS = W.T @ (C * S) - trend_part(C, S)
+    CR = R.T @ C
+    SR = R.T @ S
+
+    # Near the Nyquist period of 2 years sine and cosine coincide on yearly
+    # samples; no separate amplitude there
+    det = CC * SS - CS**2
+    det[det <= 1e-9 * (CC + SS)**2] = np.nan
+    a = (SS * CR - CS * SR) / det
+    b = (CC * SR - CS * CR) / det
+    power = (a * CR + b * SR) / sse0[:, None]
+    amplitude = np.hypot(a, b)
+
+    names = [nm for nm, _ in series]
+    table = pd.concat([
+        pd.DataFrame({'name': nm, 'var': vr, 'period': T,
+            'power': power[j], 'amplitude': amplitude[j]})
+        for j, (nm, vr) in enumerate(series)], ignore_index = True)
+
+    grid = {
+        'names': names, 'vars': [vr for _, vr in series], 'period': T,
+        'power': power, 'amplitude': amplitude}
+    return table, grid
+
+
+def candidates(table, n = 3):
+    """
+    Periods of the n highest peaks of the power per station and variable
+    """
+    def top(x):
+        idx, _ = signal.find_peaks(x['power'].to_numpy())
+        return x.iloc[idx].nlargest(n, 'power')
+
+    return table.groupby(['name', 'var'], group_keys = False).apply(top).reset_index(drop = True)
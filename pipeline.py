@@ -0,0 +1,547 @@
+"""
+Headless pipeline of the published results.
+
+The steps of the notebooks (Sections 4a to 6c) are stages of a dependency
+graph: the yearly tide analysis, loading the yearly constituents, the model
+fits per year range, the F-tests, information criteria, parameter tables,
+Z-tests against the IPCC rates, the comparison with the gridded nodal
+amplitudes, a scan for other long-period cycles and the figures. The output of every stage is cached on
+disk under a hash of
+    - the source of the stage and of the project modules it uses,
+    - its parameters,
+    - the hashes of the stages it depends on,
+    - the contents of the input files it reads,
+    - the source of constants.py, for all stages.
+A stage only runs when this hash changed (or when files it wrote have been
+removed); independent stages run in parallel processes. Forcing a stage
+also reruns all stages depending on it. Heavy packages (matplotlib,
+hvec_tide, xarray) are imported inside the stages that need them.
+
+File contents are hashed once; the digests are kept in CACHE/digests.json
+by path, size and modification time, so large inputs such as RWS_data.db
+are only read again after they changed.
+
+Output folders follow PICTURES and RESULTS in constants.py, which may be set
+through environment variables of the same name.
+
+Usage:
+    python pipeline.py [stage ...] [--force stage ...] [--workers n] [--list]
+
+HVEC-lab, 2026
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE = os.getenv('PIPELINE_CACHE', os.path.join(ROOT, '.pipeline'))
+
+RWS_DB = os.path.join(ROOT, 'Data', 'RWS_JCHS.db')
+OBSERVATIONS_DB = os.getenv('DATAPATH', '') + 'RWS_data.db'
+IPCC_DB = os.path.join(ROOT, 'Data', 'IPCC.db')
+PSMSL_DB = os.getenv('DATAPATH', '') + 'PSMSL.db'
+NODAL_GRIDS = [
+    (os.path.join(ROOT, 'Data', 'frederikse_2016_nodal_rsl.grd'), 'RSL'),
+    (os.path.join(ROOT, 'Data', 'Steffelbauer_2022_nodal.nc'), 'rsl_eq')]
+
+
+class Stage:
+    """
+    Step of the pipeline
+
+    Args:
+        name, string: unique name
+        func, function: called with the outputs of the dependencies
+            (positional, in order) and the parameters (keywords)
+        deps, list: names of the stages the function depends on
+        files, list: input files; their contents are part of the hash
+        code, list: project modules used (paths relative to the project
+            folder, without .py); their source is part of the hash
+        optional, list: input files that may be absent; their contents (or
+            absence) are part of the hash
+        params, dict: parameters
+    """
+
+    def __init__(self, name, func, deps = (), files = (), code = (), optional = (), **params):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.files = list(files)
+        self.code = list(code)
+        self.optional = list(optional)
+        self.params = params
+
+
+STAGES = {}
+
+# Project modules in the hash of every stage
+SHARED_CODE = ['constants']
+
+
+def register(name, func, deps = (), files = (), code = (), optional = (), **params):
+    STAGES[name] = Stage(
+        name, func, deps = deps, files = files, code = code, optional = optional, **params)
+    return
+
+
+#==================== Stages ====================
+
+def constituents(observations, published, output):
+    """
+    Yearly tide analysis of the observations, see Analysis/RWS_constits;
+    the published database is used when the observations are not available
+    (they are not distributed with the project, see Data/Readme.txt)
+
+    Returns:
+        dict with the database holding table const_yr
+    """
+    if not os.path.exists(observations):
+        return {'file': published}
+
+    import sys
+    import sqlite3 as sq
+    sys.path.append(os.path.join(ROOT, 'Analysis'))
+    import RWS_constits as rc  # Imports hvec_tide
+    import utils
+
+    rc.initialise()
+    const_yr = rc.run()  # Closes the observations
+    rc.ins.recorder.close()
+    rc.conn_out.close()
+
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    cnxn = sq.connect(output)
+    const_yr.rename(columns = {'set': 'const_set'}).to_sql(
+        'const_yr', cnxn, if_exists = 'replace')
+    cnxn.close()
+    utils.index_rws_db(output)
+    return {'file': output, 'files': [output]}
+
+
+def load(source, constit_set, yr_start, yr_end):
+    """
+    Yearly constituents, from the database of the constituents stage
+    """
+    import utils
+    df = utils.read_data_rws(constit_set = constit_set, yr_end = yr_end, file = source['file'])
+    df = df.dropna(how = 'all', axis = 'columns')
+    return df[df['year'].between(yr_start, yr_end)]
+
+
+def load_ipcc():
+    """
+    IPCC rates of sea level rise, all scenarios, confidence levels and years
+    """
+    import utils
+    return utils.read_ipcc_cube(file = IPCC_DB)
+
+
+def load_psmsl():
+    """
+    Annual mean sea levels of PSMSL
+    """
+    import utils
+    return utils.read_data_psmsl()
+
+
+def fits(df, vars, yr_start, yr_end, t0_lo, t0_up):
+    """
+    All candidate models, see modelComparison.fit_all
+    """
+    import modelComparison as mc
+    return mc.fit_all(df, vars, yr_start, yr_end, t0_lo = t0_lo, t0_up = t0_up)
+
+
+def ftests(cache, alpha):
+    import modelComparison as mc
+    return mc.ftests(cache, alpha = alpha)
+
+
+def criteria(cache):
+    import modelComparison as mc
+    return mc.information_criteria(cache)
+
+
+def table(cache, conf, file):
+    """
+    Parameter table in publication units (mm, centuries); written to RESULTS
+    """
+    import modelComparison as mc
+    from constants import RESULTS
+
+    param = mc.parameter_table(cache, conf = conf)
+    units = {
+        'intercept': 1e3, 'slope': 1e5, '90%_band_slope': 1e5, 'sigma_slope': 1e5,
+        'acceleration': 1e7, 'jerk': 1e9, 'A_885': 1e3, 'A_1861': 1e3, 'Rsqadj': 1e2, 't0': 1}
+    for col, fac in units.items():
+        if col in param:
+            param[col] = (fac * param[col]).round()
+    param = param.sort_values(by = ['model', 'name'])
+
+    path = os.path.join(RESULTS, file)
+    param.to_excel(path, index = False)
+    return {'table': param, 'files': [path]}
+
+
+def ztests(ipcc, table, alpha):
+    """
+    Two-sided Z-tests of the IPCC rates against the slope of the reduced
+    model, for every scenario, confidence level and year
+    """
+    import utils
+
+    param = table['table']
+    param = param.loc[param['model'] == 'Reduced', ['name', 'slope', 'sigma_slope']]
+    param = param.rename(columns = {'slope': 'mean_obs', 'sigma_slope': 'sigma_obs'})
+    return utils.ztest_ipcc(ipcc, param, alpha = alpha)
+
+
+def nodal(table):
+    """
+    Observed nodal amplitude against the gridded datasets, see nodalGrids
+    """
+    import nodalGrids as ng
+    return ng.compare(table['table'])
+
+
+def sweep(df, var, yr_end, last_start, file):
+    """
+    Sensitivity of trend and cycles to the start year; written to RESULTS
+    """
+    import startYearSweep as sys_
+    from constants import RESULTS
+
+    res, _ = sys_.sweep(df, var = var, yr_end = yr_end, last_start = last_start)
+    path = os.path.join(RESULTS, file)
+    res.to_csv(path, index = False)
+    return {'table': res, 'files': [path]}
+
+
+def period_scan(df, vars, lo, hi, n, file):
+    """
+    Periodogram of the yearly series with a linear trend, see periodScan;
+    written to RESULTS
+    """
+    import periodScan as ps
+    from constants import RESULTS
+
+    table, _ = ps.scan(df, vars = vars, T = ps.periods(lo, hi, n))
+    path = os.path.join(RESULTS, file)
+    table.to_csv(path, index = False)
+    return {'table': table, 'candidates': ps.candidates(table), 'files': [path]}
+
+
+def figures_4a(df, psmsl):
+    """
+    Overview figures of Section 4a, see renderFigures
+    """
+    import renderFigures as rf
+    from constants import PICTURES
+
+    rf.render_all(df, psmsl, workers = 1)
+    return {'files': [os.path.join(PICTURES, nm + '.jpg') for nm in rf.FIGURES]}
+
+
+def figure_fits(df, cache, var, label, yr_start, yr_end, file):
+    """
+    Observations with the fitted full and reduced models per station
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import modelComparison as mc
+    from constants import PICTURES, names
+
+    xgr = np.linspace(yr_start, yr_end, 1000)
+    fig, ax = plt.subplots(nrows = 6, ncols = 1, sharex = True, sharey = False, figsize = (20, 18))
+    for i, nm in enumerate(names):
+        data = df[df['naam'] == nm]
+        ax[i].plot(data['year'], data[var], 'r.', label = 'Data', markersize = 10)
+        for model in ['Full', 'Reduced']:
+            if (nm, var, model) in cache:
+                ax[i].plot(xgr, mc.curve(cache, nm, var, model, xgr), label = f'{model} model')
+        ax[i].set_ylabel('Level (m)')
+        ax[i].title.set_text(f'{nm}, the Netherlands; {label}')
+    ax[-1].set_xlabel('Year')
+    ax[-1].legend()
+    fig.tight_layout()
+
+    path = os.path.join(PICTURES, file)
+    fig.savefig(path)
+    plt.close(fig)
+    return {'files': [path]}
+
+
+def _graph():
+    """
+    Stages of the published results
+    """
+    from constants import YR_START, YR_END
+
+    FIT_CODE = ['modelComparison', 'regressionModels']
+    TIDE_CODE = [
+        'Analysis/RWS_constits', 'Analysis/RWS_reader', 'Analysis/RWS_store',
+        'Analysis/RWS_import_historic', 'harmonicAnalysis', 'observationCache',
+        'epochTime', 'instrumentation']
+    register('constituents', constituents, files = [RWS_DB], optional = [OBSERVATIONS_DB],
+        code = TIDE_CODE + ['utils'], observations = OBSERVATIONS_DB, published = RWS_DB,
+        output = os.path.join(CACHE, 'constituents', 'RWS_JCHS.db'))
+    register('load', load, deps = ['constituents'], code = ['utils'],
+        constit_set = 'PE', yr_start = YR_START, yr_end = YR_END)
+    register('ipcc', load_ipcc, files = [IPCC_DB], code = ['utils'])
+    register('psmsl', load_psmsl, files = [PSMSL_DB], code = ['utils'])
+
+    # Section 5a: full period; Section 5b: from 1945
+    for sec, yr_start in [('5a', YR_START), ('5b', 1945)]:
+        register(f'fits_{sec}', fits, deps = ['load'], code = FIT_CODE,
+            vars = ['z0'], yr_start = yr_start, yr_end = YR_END, t0_lo = 1960, t0_up = 1995)
+        register(f'ftests_{sec}', ftests, deps = [f'fits_{sec}'], code = FIT_CODE,
+            alpha = 0.05 / 6)
+        register(f'criteria_{sec}', criteria, deps = [f'fits_{sec}'], code = FIT_CODE)
+        register(f'table_{sec}', table, deps = [f'fits_{sec}'], code = FIT_CODE,
+            conf = 0.9, file = f'fitted_models_z0_{sec}.xlsx')
+        register(f'ztests_{sec}', ztests, deps = ['ipcc', f'table_{sec}'], code = ['utils'],
+            alpha = 0.05)
+        register(f'nodal_{sec}', nodal, deps = [f'table_{sec}'], code = ['nodalGrids'],
+            files = [file for file, _ in NODAL_GRIDS])
+        register(f'figure_fits_{sec}', figure_fits, deps = ['load', f'fits_{sec}'],
+            code = FIT_CODE, var = 'z0', label = f'mean sea level from {yr_start}',
+            yr_start = yr_start, yr_end = YR_END, file = f'fitted_models_z0_{sec}.jpg')
+
+    register('sweep', sweep, deps = ['load'], code = ['startYearSweep'],
+        var = 'z0', yr_end = YR_END, last_start = 1990, file = 'start_year_sweep_z0.csv')
+    register('period_scan', period_scan, deps = ['load'], code = ['periodScan', 'regressionModels'],
+        vars = ['z0', 'M2', 'S2'], lo = 2., hi = 40., n = 2000, file = 'period_scan.csv')
+    register('figures_4a', figures_4a, deps = ['load', 'psmsl'],
+        code = ['renderFigures', 'utils'])
+    return
+
+
+_graph()
+
+
+#==================== Runner ====================
+
+DIGESTS = os.path.join(CACHE, 'digests.json')
+
+
+def _read_digests():
+    """
+    Stored digests: path: [size, mtime_ns, sha1]
+    """
+    try:
+        with open(DIGESTS) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_digests(digests):
+    os.makedirs(CACHE, exist_ok = True)
+    tmp = f'{DIGESTS}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(digests, f, indent = 1)
+    os.replace(tmp, DIGESTS)
+    return
+
+
+def _digest_file(path, digests):
+    """
+    SHA-1 of a file; taken from digests while its size and modification
+    time are unchanged, otherwise computed and added
+    """
+    if not os.path.exists(path):
+        return 'missing'
+    st = os.stat(path)
+    path = os.path.abspath(path)
+    stored = digests.get(path)
+    if stored is None or stored[:2] != [st.st_size, st.st_mtime_ns]:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digests[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return digests[path][2]
+
+
+def keys(stages = STAGES):
+    """
+    Hash of every stage, see the module description
+    """
+    res = {}
+    digests = _read_digests()
+    known = json.dumps(digests, sort_keys = True)
+
+    def key(name):
+        if name not in res:
+            st = stages[name]
+            text = json.dumps({
+                'name': name,
+                'source': inspect.getsource(st.func),
+                'code': [
+                    _digest_file(os.path.join(ROOT, m + '.py'), digests)
+                    for m in SHARED_CODE + st.code],
+                'params': st.params,
+                'deps': [key(d) for d in st.deps],
+                'files': [_digest_file(f, digests) for f in st.files + st.optional],
+            }, sort_keys = True, default = str)
+            res[name] = hashlib.sha1(text.encode()).hexdigest()[:16]
+        return res[name]
+
+    for name in stages:
+        key(name)
+    if json.dumps(digests, sort_keys = True) != known:
+        _write_digests(digests)
+    return res
+
+
+def _path(name, key):
+    return os.path.join(CACHE, name, key + '.pkl')
+
+
+def cached(name, key):
+    """
+    True if the output of a stage is in the cache and the files it wrote
+    still exist
+    """
+    path = _path(name, key)
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        out = pickle.load(f)
+    files = out.get('files', []) if isinstance(out, dict) else []
+    return all(os.path.exists(p) for p in files)
+
+
+def output(name, key = None):
+    """
+    Cached output of a stage; for use in notebooks
+    """
+    key = key or keys()[name]
+    with open(_path(name, key), 'rb') as f:
+        return pickle.load(f)
+
+
+def execute(name, key, dep_keys):
+    """
+    Run a single stage in this process and store its output
+    """
+    st = STAGES[name]
+    missing = [f for f in st.files if not os.path.exists(f)]
+    if missing:  # sqlite3 would create an empty database
+        raise FileNotFoundError(', '.join(missing))
+    args = [output(d, k) for d, k in zip(st.deps, dep_keys)]
+    t0 = time.perf_counter()
+    out = st.func(*args, **st.params)
+
+    path = _path(name, key)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(out, f)
+    os.replace(path + '.tmp', path)
+    return time.perf_counter() - t0
+
+
+def required(targets):
+    """
+    Targets and all stages they depend on
+    """
+    res = set()
+
+    def add(name):
+        if name not in res:
+            res.add(name)
+            for d in STAGES[name].deps:
+                add(d)
+
+    for name in targets:
+        add(name)
+    return res
+
+
+def dependents(names):
+    """
+    Stages and all stages depending on them
+    """
+    res = set(names)
+    while True:
+        new = {nm for nm, st in STAGES.items() if nm not in res and res & set(st.deps)}
+        if not new:
+            return res
+        res |= new
+
+
+def run(targets = None, force = (), workers = None):
+    """
+    Run the stages needed for the targets; stages whose dependencies are
+    available run in parallel
+
+    Args:
+        targets, list: stages to produce; default all
+        force, list: stages to run even when cached, with all stages
+            depending on them
+        workers, int: number of worker processes
+
+    Returns:
+        dict name: 'cached', seconds of the run, or the error
+    """
+    hashes = keys()
+    todo = required(targets or list(STAGES))
+    force = dependents(force)
+    status = {}
+    for name in todo:
+        if name not in force and cached(name, hashes[name]):
+            status[name] = 'cached'
+
+    running = {}
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        while True:
+            for name in sorted(todo - set(status) - set(running.values())):
+                deps = STAGES[name].deps
+                if any(isinstance(status.get(d), Exception) for d in deps):
+                    status[name] = RuntimeError('dependency failed')
+                    print(f'{name:20s} {status[name]!r}')
+                elif all(d in status for d in deps):
+                    fut = pool.submit(execute, name, hashes[name], [hashes[d] for d in deps])
+                    running[fut] = name
+            if not running:
+                break
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    status[name] = fut.result()
+                except Exception as err:
+                    status[name] = err
+                print(f'{name:20s} {status[name]!r}')
+    return status
+
+
+#================= main ===================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Pipeline of the published results')
+    parser.add_argument('targets', nargs = '*', help = 'Stages to produce; default all')
+    parser.add_argument('--force', nargs = '*', default = [], help = 'Stages to rerun')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--list', action = 'store_true', help = 'Show stages and cache state')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    if args.list:
+        hashes = keys()
+        for name, st in STAGES.items():
+            state = 'cached' if cached(name, hashes[name]) else 'stale'
+            print(f'{name:20s} {state:7s} <- {", ".join(st.deps)}')
+    else:
+        status = run(args.targets, force = args.force, workers = args.workers)
+        failed = {nm: err for nm, err in status.items() if isinstance(err, Exception)}
+        print(f'{len(status) - len(failed)} stages done, {len(failed)} failed')
@@ -2,7 +2,11 @@
 Empirical sea level models
 """
 
+import inspect
+import itertools
 import numpy as np
+import pandas as pd
+from scipy import linalg, optimize
 
 T = np.array([8.85 / 1, 18.61])  # Period of multi-year astronomical cycles
 omega = (2 * np.pi) / T
@@ -74,6 +78,14 @@ def reducedModel(t, a, b, Ac1, As1, Ac2, As2):
     return linear_fnc(t, a, b) + harmonic(t, Ac1, As1, Ac2, As2)
 
 
+def acceleratedModel(t, a, b, c, Ac1, As1, Ac2, As2):
+    """
+    Reduced model with a constant acceleration added. Used for the
+    sensitivity of trend and cycles to the start year; not published
+    """
+    return model2(t, a, b, c) + harmonic(t, Ac1, As1, Ac2, As2)
+
+
 def jerked_fnc(t, p0, p1, p2, p3, t0):
     """
     Model with trend, acceleration and jerk starting at time t0
@@ -99,3 +111,398 @@ def fullModel(t, p0, p1, p2, p3, Ac0, As0, Ac1, As1, t0):
         + Ac1 * np.cos(omega[1] * t) + As1 * np.sin(omega[1] * t)
     )
     return  jerky + oscillate
+
+
+#==================== Linear models in design-matrix form ====================
+
+def _cycle(t, i):
+    """
+    Cosine and sine columns of multi-year cycle i
+    """
+    return [np.cos(omega[i] * t), np.sin(omega[i] * t)]
+
+
+# Columns of the linear models, in the order of the model parameters
+DESIGN = {
+    model1: lambda t: [np.ones_like(t), t],
+    model2: lambda t: [np.ones_like(t), t, t**2],
+    model3a: lambda t: [np.ones_like(t), t] + _cycle(t, 0),
+    model3b: lambda t: [np.ones_like(t), t] + _cycle(t, 1),
+    harmonic: lambda t: _cycle(t, 0) + _cycle(t, 1),
+    linear_fnc: lambda t: [np.ones_like(t), t],
+    reducedModel: lambda t: [np.ones_like(t), t] + _cycle(t, 0) + _cycle(t, 1),
+    acceleratedModel: lambda t: [np.ones_like(t), t, t**2] + _cycle(t, 0) + _cycle(t, 1),
+}
+
+
+def design_matrix(model, t):
+    """
+    Design matrix of a linear model; model(t, *p) equals design_matrix(model, t) @ p
+    """
+    t = np.asarray(t, dtype = float)
+    return np.column_stack(DESIGN[model](t))
+
+
+def parameter_names(model):
+    """
+    Names of the model parameters, from the signature of the model function
+    """
+    return list(inspect.signature(model).parameters)[1:]
+
+
+def _qr_solve(X, Y):
+    """
+    Least-squares solution of X p = Y for all columns of Y by QR decomposition
+    """
+    n, k = X.shape
+    Q, R = np.linalg.qr(X)
+    P = linalg.solve_triangular(R, Q.T @ Y)
+    Rinv = linalg.solve_triangular(R, np.eye(k))
+    res = Y - X @ P
+    dof = n - k
+    s2 = (res**2).sum(axis = 0) / dof
+    sst = ((Y - Y.mean(axis = 0))**2).sum(axis = 0)
+    return {
+        'p': P,
+        'cov': s2[:, None, None] * (Rinv @ Rinv.T),
+        'sigma': np.sqrt(np.outer(np.diag(Rinv @ Rinv.T), s2)),
+        'Rsqadj': 1 - s2 / (sst / (n - 1)),
+        'dof': np.full(Y.shape[1], dof),
+    }
+
+
+def _patterns(Y):
+    """
+    Generator of (rows, columns) of Y sharing the same available values
+    """
+    valid = ~np.isnan(Y)
+    patterns, group = np.unique(valid.T, axis = 0, return_inverse = True)
+    for i, rows in enumerate(patterns):
+        yield rows, np.flatnonzero(group.ravel() == i)
+
+
+def linear_fit(model, t, y, centre = True):
+    """
+    Direct fit of a linear model, for one or many series at once.
+
+    Time is centred on its mean before fitting (per series, over the
+    available points), as in the curve fits of the notebooks. Series with
+    missing values (NaN) are fitted on their available points; series with
+    the same pattern of missing values share one decomposition.
+
+    Args:
+        model, function: one of the linear models in DESIGN
+        t, array (n,): time
+        y, array (n,) or (n, m): observations
+        centre, bool: centre time on its mean
+
+    Returns:
+        dict with p, sigma (k[, m]), cov ([m, ]k, k), Rsqadj, dof and tmean
+        ([m]); shapes follow the dimension of y
+    """
+    t = np.asarray(t, dtype = float)
+    y = np.asarray(y, dtype = float)
+    Y = y.reshape(len(t), -1)
+    k = len(parameter_names(model))
+    m = Y.shape[1]
+
+    res = {
+        'p': np.full((k, m), np.nan),
+        'sigma': np.full((k, m), np.nan),
+        'cov': np.full((m, k, k), np.nan),
+        'Rsqadj': np.full(m, np.nan),
+        'dof': np.zeros(m, dtype = int),
+        'tmean': np.full(m, np.nan)}
+
+    for rows, cols in _patterns(Y):
+        if rows.sum() <= k:
+            continue
+        tmean = t[rows].mean() if centre else 0.
+        sol = _qr_solve(design_matrix(model, t[rows] - tmean), Y[rows][:, cols])
+        for ky in ['p', 'sigma']:
+            res[ky][:, cols] = sol[ky]
+        for ky in ['cov', 'Rsqadj', 'dof']:
+            res[ky][cols] = sol[ky]
+        res['tmean'][cols] = tmean
+
+    if y.ndim == 1:
+        res = {ky: val[..., 0] if ky in ['p', 'sigma'] else val[0] for ky, val in res.items()}
+    return res
+
+
+def linear_fit_frame(model, df, vars, name = 'naam', time = 'year'):
+    """
+    Fit a linear model to all stations and response variables in one call
+
+    Args:
+        model, function: one of the linear models in DESIGN
+        df, dataframe: long table as returned by utils.read_data_rws
+        vars, list: response variables, e.g. ['z0', 'M2', 'S2', 'M2+S2']
+        name, string: column with station names
+        time, string: column with time
+
+    Returns:
+        dataframe with a row per station and variable holding parameters,
+        their standard deviations (sigma_<parameter>) and Rsqadj
+    """
+    wide = df.pivot_table(index = time, columns = name, values = vars)
+    res = linear_fit(model, wide.index.to_numpy(), wide.to_numpy())
+
+    pnames = parameter_names(model)
+    out = pd.DataFrame(wide.columns.to_list(), columns = ['var', 'name'])
+    for i, pn in enumerate(pnames):
+        out[pn] = res['p'][i]
+    for i, pn in enumerate(pnames):
+        out['sigma_' + pn] = res['sigma'][i]
+    out['Rsqadj'] = res['Rsqadj']
+    out['tmean'] = res['tmean']
+    return out[['name', 'var'] + out.columns[2:].to_list()]
+
+
+#==================== Full model: profile over breakpoint t0 ====================
+
+def design_full(t, t0):
+    """
+    Design matrix of fullModel for a fixed breakpoint t0; columns in the
+    order of p0, p1, p2, p3, Ac0, As0, Ac1, As1. For an array of t0 a stack
+    of matrices (len(t0), n, 8) is returned.
+    """
+    t = np.asarray(t, dtype = float)
+    dt = t - np.asarray(t0, dtype = float)[..., None]
+    fac = (np.sign(dt) + 1) / 2
+    fixed = np.broadcast_to(
+        np.column_stack([np.ones_like(t), t] + _cycle(t, 0) + _cycle(t, 1)),
+        dt.shape + (6, ))
+    return np.concatenate(
+        [fixed[..., :2], (fac * dt**2 / 2)[..., None], (fac * dt**3 / 6)[..., None],
+        fixed[..., 2:]], axis = -1)
+
+
+def _bounded_lsq(X, Y, nonneg):
+    """
+    Least squares with non-negativity of the parameters in nonneg, for all
+    columns of Y and optionally a stack of design matrices X (..., n, k).
+    With few bounds the optimum is found exactly by solving every
+    combination of bounds held at zero and keeping the best feasible
+    solution.
+
+    Returns:
+        P, array (..., k, m): parameters
+        sse, array (..., m): sum of squared residuals
+    """
+    k = X.shape[-1]
+    P = np.full(X.shape[:-2] + (k, Y.shape[1]), np.nan)
+    sse = np.full(X.shape[:-2] + (Y.shape[1], ), np.inf)
+
+    for fixed in itertools.chain.from_iterable(
+            itertools.combinations(nonneg, r) for r in range(len(nonneg) + 1)):
+        free = [j for j in range(k) if j not in fixed]
+        Xf = X[..., free]
+        Q, R = np.linalg.qr(Xf)
+        Pf = np.linalg.solve(R, np.swapaxes(Q, -1, -2) @ Y)
+        ok = np.all(Pf[..., [free.index(j) for j in nonneg if j in free], :] >= 0, axis = -2)
+        err = ((Y - Xf @ Pf)**2).sum(axis = -2)
+
+        better = ok & (err < sse)
+        Pnew = np.zeros_like(P)
+        Pnew[..., free, :] = Pf
+        P = np.where(better[..., None, :], Pnew, P)
+        sse = np.where(better, err, sse)
+    return P, sse
+
+
+def breakpoint_fit(t, y, t0_lo = 1960, t0_up = 1995, n_grid = 141, nonneg = (2, 3)):
+    """
+    Fit of fullModel by profiling over the breakpoint t0.
+
+    For fixed t0 the model is linear in the other parameters; the bounds on
+    acceleration and jerk (p2, p3 >= 0, as in the notebooks) are respected
+    exactly. The residual variance is evaluated on a grid of t0 within the
+    prescribed bounds; the best grid point is refined by a bounded scalar
+    search between its neighbours. Time is centred on its mean (per
+    series), so p[8] is t0 minus the mean year, as in the notebooks.
+
+    Args:
+        t, array (n,): time (years)
+        y, array (n,) or (n, m): observations; series may hold NaN
+        t0_lo, t0_up, float: bounds of the breakpoint (years)
+        n_grid, int: number of grid points of t0
+        nonneg, tuple: indices of parameters bounded at zero from below
+
+    Returns:
+        dict with p (9[, m]), t0, Rsqadj, tmean ([m]) and profile, a dict
+        with the t0 grid (years) and residual variance (n_grid[, m])
+    """
+    t = np.asarray(t, dtype = float)
+    y = np.asarray(y, dtype = float)
+    Y = y.reshape(len(t), -1)
+    m = Y.shape[1]
+    k = 9
+
+    grid = np.linspace(t0_lo, t0_up, n_grid)
+    res = {
+        'p': np.full((k, m), np.nan),
+        't0': np.full(m, np.nan),
+        'Rsqadj': np.full(m, np.nan),
+        'tmean': np.full(m, np.nan),
+        'profile': {'t0': grid, 'var': np.full((n_grid, m), np.nan)}}
+
+    for rows, cols in _patterns(Y):
+        n = rows.sum()
+        if n <= k:
+            continue
+        tmean = t[rows].mean()
+        tc = t[rows] - tmean
+        Yc = Y[rows][:, cols]
+
+        _, sse = _bounded_lsq(design_full(tc, grid - tmean), Yc, nonneg)
+        res['profile']['var'][:, cols] = sse / (n - k)
+
+        sst = ((Yc - Yc.mean(axis = 0))**2).sum(axis = 0)
+        for j, col in enumerate(cols):
+            i = np.argmin(sse[:, j])
+            lo, up = grid[max(i - 1, 0)] - tmean, grid[min(i + 1, n_grid - 1)] - tmean
+            opt = optimize.minimize_scalar(
+                lambda t0: _bounded_lsq(design_full(tc, t0), Yc[:, [j]], nonneg)[1][0],
+                bounds = (lo, up), method = 'bounded', options = {'xatol': 1e-4})
+            t0 = opt.x if opt.fun <= sse[i, j] else grid[i] - tmean
+
+            P, err = _bounded_lsq(design_full(tc, t0), Yc[:, [j]], nonneg)
+            res['p'][:8, col] = P[:, 0]
+            res['p'][8, col] = t0
+            res['t0'][col] = t0 + tmean
+            res['Rsqadj'][col] = 1 - (err[0] / (n - k)) / (sst[j] / (n - 1))
+            res['tmean'][col] = tmean
+
+    if y.ndim == 1:
+        res = {
+            'p': res['p'][:, 0], 't0': res['t0'][0], 'Rsqadj': res['Rsqadj'][0],
+            'tmean': res['tmean'][0],
+            'profile': {'t0': grid, 'var': res['profile']['var'][:, 0]}}
+    return res
+
+
+#==================== Compiled models ====================
+
+class CompiledModel:
+    """
+    A model bound to a fixed time vector.
+
+    The harmonic basis (and for linear models the full design matrix) is
+    computed once; evaluations reuse preallocated arrays and an analytic
+    Jacobian is available for the optimiser. Supported are the linear
+    models in DESIGN, jerked_fnc and fullModel. Time is centred on its mean
+    by default, like linear_fit and breakpoint_fit. The arrays returned by
+    a call and by jac are reused buffers; copy them when they are kept.
+
+    Example:
+        cm = CompiledModel(fullModel, data['year'])
+        res = cm.fit(data['z0'], p0, bounds = (lo, up))
+        curve = cm.evaluate_at(res['p'], xgr)
+    """
+
+    def __init__(self, model, t, centre = True):
+        t = np.asarray(t, dtype = float)
+        self.model = model
+        self.names = parameter_names(model)
+        self.tmean = t.mean() if centre else 0.
+        self.t = t - self.tmean
+        n = len(t)
+
+        if model in DESIGN:
+            self.X = design_matrix(model, self.t)
+        elif model in (fullModel, jerked_fnc):
+            # Columns multiplying p0, p1 (and Ac0, As0, Ac1, As1)
+            cols = [np.ones(n), self.t]
+            if model is fullModel:
+                cols += _cycle(self.t, 0) + _cycle(self.t, 1)
+            self._base = np.column_stack(cols)
+            self._dt = np.empty(n)
+            self._fac = np.empty(n)
+            self._jac = np.zeros((n, len(self.names)))
+            lin = [0, 1] + ([4, 5, 6, 7] if model is fullModel else [])
+            self._jac[:, lin] = self._base
+            self._lin = lin
+        else:
+            raise ValueError(f'No compiled form of {model.__name__}')
+        self._out = np.empty(n)
+
+    def _jerk_terms(self, p):
+        """
+        Update time since breakpoint and the step function for t0 = p[-1]
+        """
+        np.subtract(self.t, p[-1], out = self._dt)
+        np.greater(self._dt, 0, out = self._fac, casting = 'unsafe')
+        self._fac[self._dt == 0] = 0.5  # As (sign(t - t0) + 1) / 2
+        return self._dt, self._fac
+
+    def __call__(self, p):
+        """
+        Model values at the compiled time vector
+        """
+        p = np.asarray(p, dtype = float)
+        if self.model in DESIGN:
+            return np.dot(self.X, p, out = self._out)
+
+        dt, fac = self._jerk_terms(p)
+        np.dot(self._base, p[self._lin], out = self._out)
+        self._out += fac * dt**2 * (p[2] / 2 + p[3] / 6 * dt)
+        return self._out
+
+    def jac(self, p):
+        """
+        Analytic Jacobian (n, k) with respect to the parameters
+        """
+        p = np.asarray(p, dtype = float)
+        if self.model in DESIGN:
+            return self.X
+
+        dt, fac = self._jerk_terms(p)
+        self._jac[:, 2] = fac * dt**2 / 2
+        self._jac[:, 3] = fac * dt**3 / 6
+        self._jac[:, -1] = -fac * dt * (p[2] + p[3] / 2 * dt)
+        return self._jac
+
+    def evaluate_at(self, p, t):
+        """
+        Model values at other times, e.g. a plotting grid (uncentred years)
+        """
+        return self.model(np.asarray(t, dtype = float) - self.tmean, *p)
+
+    def fit(self, y, p0 = None, bounds = (-np.inf, np.inf)):
+        """
+        Least-squares fit. Linear models are solved directly; the others by
+        trust-region least squares with the analytic Jacobian.
+
+        Args:
+            y, array: observations
+            p0, array: starting point (not used for linear models)
+            bounds, tuple: lower and upper bounds of the parameters; t0 in
+                centred time, as in the notebooks
+
+        Returns:
+            dict with p, sigma, cov, Rsqadj and the fitted values ymodel
+        """
+        y = np.asarray(y, dtype = float)
+        n, k = len(y), len(self.names)
+
+        if self.model in DESIGN:
+            res = linear_fit(self.model, self.t, y, centre = False)
+            res['ymodel'] = self(res['p']).copy()
+            return res
+
+        sol = optimize.least_squares(
+            lambda p: self(p) - y, p0, jac = self.jac, bounds = bounds,
+            method = 'trf', x_scale = 'jac')
+        p = sol.x
+        J = self.jac(p)
+        s2 = 2 * sol.cost / (n - k)
+        cov = s2 * np.linalg.pinv(J.T @ J)
+        sst = ((y - y.mean())**2).sum()
+        return {
+            'p': p,
+            'sigma': np.sqrt(np.diag(cov)),
+            'cov': cov,
+            'Rsqadj': 1 - s2 / (sst / (n - 1)),
+            'dof': n - k,
+            'ymodel': self(p).copy()}
@@ -0,0 +1,127 @@
+"""
+Rendering stage of the overview figures of Section 4a.
+
+The figures of utils.graph_* are rendered in a pool of processes on the
+non-interactive Agg backend. Every figure gets a hash of the plotted columns
+and of its style (source of the graph function and the plot settings in
+constants); the hash is stored next to the picture in PICTURES and a figure
+is only rendered again when the hash changes or the picture is missing.
+
+HVEC-lab, 2026
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import inspect
+import os
+import matplotlib
+import pandas as pd
+
+import constants as cst
+import utils
+
+
+# Figure: graph function, columns used per argument
+FIGURES = {
+    'Rsq_all': (utils.graph_Rsqadj, [['naam', 'year', 'Rsq_adj']]),
+    'MSL_all': (utils.graph_z0, [
+        ['naam', 'year', 'count', 'z0', 'zmean'], ['name', 'time', 'level']]),
+    'M2+S2_all': (utils.graph_amplitudes, [
+        ['naam', 'year', 'count', 'M2', 'S2', 'M2+S2']]),
+    'windeffect_all': (utils.graph_windeffect, [['naam', 'year', 'count', 'smean']]),
+}
+
+
+def digest(func, frames):
+    """
+    Hash of the plotted data and the style of a figure
+
+    Args:
+        func, function: graph function
+        frames, list: dataframes passed to the graph function
+    """
+    h = hashlib.sha1()
+    for df in frames:
+        h.update(','.join(df.columns).encode())
+        h.update(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes())
+    h.update(inspect.getsource(func).encode())
+    h.update(repr((cst.names, cst.Nmn, cst.figsize, matplotlib.__version__)).encode())
+    return h.hexdigest()
+
+
+def _sidecar(name):
+    return os.path.join(cst.PICTURES, name + '.jpg.sha1')
+
+
+def up_to_date(name, key):
+    """
+    True if the picture exists and was rendered from data with this hash
+    """
+    if not os.path.exists(os.path.join(cst.PICTURES, name + '.jpg')):
+        return False
+    try:
+        with open(_sidecar(name)) as f:
+            return f.read().strip() == key
+    except FileNotFoundError:
+        return False
+
+
+def init_worker():
+    """
+    Non-interactive backend in worker processes
+    """
+    matplotlib.use('Agg')
+    return
+
+
+def render(name, func, frames, key):
+    """
+    Render a single figure and store its hash
+    """
+    import matplotlib.pyplot as plt
+
+    func(*frames)
+    plt.close('all')
+    with open(_sidecar(name), 'w') as f:
+        f.write(key)
+    return name
+
+
+def render_all(df, psmsl, figures = FIGURES, workers = None, force = False):
+    """
+    Render the figures whose data or style changed
+
+    Args:
+        df, dataframe: table as returned by utils.read_data_rws
+        psmsl, dataframe: table as returned by utils.read_data_psmsl
+        figures, dict: figures to render, see FIGURES
+        workers, int: number of worker processes; default number of CPUs
+        force, bool: render all figures
+
+    Returns:
+        list of rendered figures
+    """
+    sources = {utils.graph_z0: [df, psmsl]}
+
+    jobs = []
+    for name, (func, columns) in figures.items():
+        frames = [data[cols] for data, cols in zip(sources.get(func, [df]), columns)]
+        key = digest(func, frames)
+        if force or not up_to_date(name, key):
+            jobs.append((name, func, frames, key))
+
+    if not jobs:
+        return []
+
+    with ProcessPoolExecutor(
+            max_workers = min(workers or os.cpu_count(), len(jobs)),
+            initializer = init_worker) as pool:
+        futures = [pool.submit(render, *job) for job in jobs]
+        return [f.result() for f in futures]
+
+
+#================= main ===================
+if __name__ == '__main__':
+    df = utils.read_data_rws(constit_set = 'PE')
+    psmsl = utils.read_data_psmsl()
+    print(render_all(df, psmsl))
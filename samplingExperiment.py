@@ -0,0 +1,130 @@
+"""
+Sensitivity of the mean sea level to the sampling of the water levels.
+
+The harmonic basis (harmonicAnalysis.basis) is evaluated once on the full
+resolution series of a station. Every sampling scheme is a boolean mask on
+these rows; the selected rows are solved in batches of masks of similar size
+with the stacked least squares or robust fit of harmonicAnalysis, so adding
+schemes (intervals, high and low waters, random thinning, gaps) or years
+does not rebuild the basis. As in the yearly analysis no nodal corrections
+and no trend are applied.
+
+HVEC-lab, 2026
+"""
+
+import numpy as np
+import pandas as pd
+
+from epochTime import epoch_days, epoch_seconds
+import harmonicAnalysis as hx
+import highLowWater as hl
+
+
+CONSTIT = ['M2', 'S2', 'M4', 'SA', 'N2', 'O1', 'MS4']  # As in Section 4b
+
+BATCH = 8  # Masks solved at once
+
+
+def interval(t, seconds):
+    """
+    Mask of samples on a regular interval, e.g. 3 * 3600 for 3-hourly data
+    """
+    return epoch_seconds(t) % seconds == 0
+
+
+def high_low(h):
+    """
+    Mask of high and low waters, see highLowWater
+    """
+    return hl.flags(np.asarray(h))
+
+
+def thinning(n, fraction, seed = 0):
+    """
+    Mask keeping a random fraction of n samples
+    """
+    rng = np.random.default_rng(seed)
+    return rng.random(n) < fraction
+
+
+def gaps(t, n_gaps, length, seed = 0):
+    """
+    Mask with n_gaps random gaps of the given length (s)
+    """
+    s = epoch_seconds(t)
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(s.min(), s.max() - length, size = n_gaps)
+    res = np.ones(len(s), dtype = bool)
+    for st in starts:
+        res &= ~((s >= st) & (s < st + length))
+    return res
+
+
+def standard_masks(t, h):
+    """
+    The sampling schemes of Section 4b
+    """
+    return {
+        'High and low': high_low(h),
+        '3 hour interval': interval(t, 3 * 3600),
+        '1 hour interval': interval(t, 3600),
+        '10 minute interval': interval(t, 600),
+    }
+
+
+def run(t, h, masks, constit = CONSTIT, years = None, method = 'robust', batch = BATCH):
+    """
+    Harmonic analysis of a single station for every sampling mask
+
+    Args:
+        t, array: time, datetimes or epoch seconds
+        h, array: water levels
+        masks, dict: name: boolean array per sample
+        constit, list: constituent names
+        years, array: year per sample; if given every mask is solved per
+            year
+        method, string: 'ols' or 'robust'
+        batch, int: masks solved at once; bounds memory use
+
+    Returns:
+        dataframe with mask (and year), z0, zmean, count, amplitudes and
+        Rsq_adj
+    """
+    days = epoch_days(epoch_seconds(t))
+    h = np.asarray(h, dtype = float)
+    X = hx.basis(days, constit, tref = days.mean())
+
+    if years is not None:
+        years = np.asarray(years)
+
+    units = []
+    for nm, mask in masks.items():
+        mask = np.asarray(mask, dtype = bool)
+        if years is None:
+            units.append(({'mask': nm}, mask))
+        else:
+            units += [({'mask': nm, 'year': yr}, mask & (years == yr)) for yr in np.unique(years)]
+    units = [(label, np.flatnonzero(mask)) for label, mask in units]
+    units = [unit for unit in units if len(unit[1]) >= 2 * X.shape[1]]
+
+    # Masks of similar size are solved together to limit padding
+    order = sorted(range(len(units)), key = lambda i: len(units[i][1]))
+
+    res = []
+    for i in range(0, len(order), batch):
+        part = order[i: i + batch]
+        rows = [units[j][1] for j in part]
+        idx = np.concatenate(rows)
+        groups = np.repeat(np.arange(len(part)), [len(r) for r in rows])
+        _, Xs, hs, mask = hx.stack(X[idx], h[idx], groups)
+
+        if method == 'robust':
+            b, _ = hx.irls(Xs, hs, mask)
+        else:
+            b = hx.wls(Xs, hs, mask.astype(float))
+
+        tmp = hx.summarise(b, Xs, hs, mask, constit)
+        tmp.index = part
+        res.append(pd.concat([pd.DataFrame([units[j][0] for j in part], index = part), tmp], axis = 1))
+
+    return pd.concat(res).sort_index().reset_index(drop = True)
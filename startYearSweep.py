@@ -0,0 +1,114 @@
+"""
+Sensitivity of trend, acceleration and nodal amplitude to the start year.
+
+Section 5b repeats the analysis of Section 5a for a single later start
+year. Here all start years are evaluated at once: the normal equations of
+regressionModels.acceleratedModel are accumulated once over the full
+record and the leading year is removed by a rank-one downdate before each
+next start year, instead of refitting the model for every start year.
+
+HVEC-lab, 2026
+"""
+
+import numpy as np
+import pandas as pd
+
+import regressionModels as mdl
+
+
+SCALE = 100.  # Time unit (years) of the polynomial terms; keeps the normal equations well conditioned
+
+
+def _design(t, tref):
+    """
+    Design matrix of acceleratedModel with scaled polynomial terms
+    """
+    tau = (t - tref) / SCALE
+    X = mdl.design_matrix(mdl.acceleratedModel, t - tref)
+    X[:, 1] = tau
+    X[:, 2] = tau**2
+    return X
+
+
+def sweep(df, var = 'z0', yr_end = 2021, last_start = 1990, tref = None):
+    """
+    Slope, acceleration and cycle amplitudes as a function of start year
+
+    Args:
+        df, dataframe: table as returned by utils.read_data_rws
+        var, string: response variable
+        yr_end, int: last year of all fits
+        last_start, int: last start year evaluated
+        tref, float: reference year of the polynomial; default the mean of
+            the full record
+
+    Returns:
+        table, dataframe: per station and start year the number of years,
+            slope (at the centre of the fitted period) and its standard
+            deviation, acceleration, A_885 and A_1861
+        grid, dict: names, year_start and per quantity an array
+            (station, start year), ready for a heatmap
+    """
+    data = df[df['year'] <= yr_end]
+    wide = data.pivot_table(index = 'year', columns = 'naam', values = var)
+    wide = wide.reindex(np.arange(wide.index.min(), yr_end + 1))
+    years = wide.index.to_numpy(dtype = float)
+    names = wide.columns.to_list()
+
+    Y = wide.to_numpy(dtype = float)
+    W = (~np.isnan(Y)).astype(float)  # Availability per year and station
+    Y = np.nan_to_num(Y)
+
+    tref = years.mean() if tref is None else tref
+    X = _design(years, tref)
+    k = X.shape[1]
+
+    # Normal equations per station over the full record
+    A = np.einsum('nm,ni,nj->mij', W, X, X)
+    b = np.einsum('nm,ni,nm->mi', W, X, Y)
+    yty = (W * Y**2).sum(axis = 0)
+    n = W.sum(axis = 0)
+    tsum = W.T @ years
+
+    starts = years[years <= last_start]
+    quantities = ['n', 'slope', 'sigma_slope', 'acceleration', 'A_885', 'A_1861']
+    grid = {ky: np.full((len(names), len(starts)), np.nan) for ky in quantities}
+
+    for i, ys in enumerate(starts):
+        ok = n > k
+        p = np.full((len(names), k), np.nan)
+        Ainv = np.full((len(names), k, k), np.nan)
+        Ainv[ok] = np.linalg.inv(A[ok])
+        p[ok] = np.einsum('mij,mj->mi', Ainv[ok], b[ok])
+
+        sse = yty - 2 * np.einsum('mi,mi->m', p, b) + np.einsum('mi,mij,mj->m', p, A, p)
+        s2 = sse / (n - k)
+
+        # Slope at the centre of the fitted period and its variance
+        tc = (tsum / n - tref) / SCALE
+        g = np.zeros((len(names), k))
+        g[:, 1] = 1 / SCALE
+        g[:, 2] = 2 * tc / SCALE
+        grid['n'][:, i] = n
+        grid['slope'][:, i] = np.einsum('mi,mi->m', g, p)
+        grid['sigma_slope'][:, i] = np.sqrt(s2 * np.einsum('mi,mij,mj->m', g, Ainv, g))
+        grid['acceleration'][:, i] = 2 * p[:, 2] / SCALE**2
+        grid['A_885'][:, i] = np.hypot(p[:, 3], p[:, 4])
+        grid['A_1861'][:, i] = np.hypot(p[:, 5], p[:, 6])
+
+        # Rank-one downdate: remove the leading year
+        x, w, y = X[i], W[i], Y[i]
+        A -= w[:, None, None] * np.outer(x, x)[None]
+        b -= (w * y)[:, None] * x[None]
+        yty -= w * y**2
+        n -= w
+        tsum -= w * ys
+
+    table = pd.concat([
+        pd.DataFrame({'name': nm, 'year_start': starts.astype(int),
+            **{ky: grid[ky][j] for ky in quantities}})
+        for j, nm in enumerate(names)], ignore_index = True)
+    table = table[table['n'] > k].reset_index(drop = True)
+
+    grid.update({'names': names, 'year_start': starts.astype(int)})
+    return table, grid
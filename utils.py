@@ -4,49 +4,94 @@ HVEC, 2022
 """
 
 import os
-import copy as cp
+import pathlib
 import sqlite3 as sq
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
+import scipy.stats as stat
 
 import hvec_support
 from constants import *
 
 
-# Settings
-plt.rcParams['axes.grid'] = True
+RWS_DB = os.path.join(r'./Data', 'RWS_JCHS.db')
+IPCC_DB = os.path.join(r'./Data', 'IPCC.db')
 
+# Statistics of the IPCC projections; sigma is derived from the 90% band
+# when the database does not hold it
+IPCC_STATS = ['90%_low', 'median', '90%_high', 'sigma']
+IPCC_SCALE = 1e5  # m/year to mm/century, the unit of the parameter tables
+CUBE_DIMS = ['name', 'scenario', 'confidence', 'year', 'stat']
 
-def read_data_rws(constit_set):
+# In-process memory of read_data_rws; entries are valid for a given file mtime
+_memo = {}
+
+
+def index_rws_db(file = RWS_DB):
     """
-    Read table with observed water levels; complete years only
+    Create the index used by read_data_rws and drop the unused index on
+    (naam, level_1). Needs write access; run once.
     """
-    # Connect database
-    path = r'./Data'
-    file = 'RWS_JCHS.db'
-    conn_str = os.path.join(path, file)
-    cnxn = sq.connect(conn_str, detect_types = True)
+    cnxn = sq.connect(file)
+    cnxn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_const_yr_const_set_naam_year "
+        "ON 'const_yr' (const_set, naam, year)")
+    cnxn.execute("DROP INDEX IF EXISTS ix_const_yr_naam_level_1")
+    cnxn.commit()
+    cnxn.close()
+    return
+
+
+def read_data_rws(constit_set, yr_end = 2021, columns = None, file = RWS_DB):
+    """
+    Read table with yearly tidal constituents; complete years only
+
+    Selection of constituent set, stations, years and columns is done in
+    the query. Results are kept in memory and reused until the database
+    file changes; a copy is returned, so callers may modify it.
+
+    Args:
+        constit_set, string: constituent set, e.g. 'PE'
+        yr_end, int: last year included
+        columns, list: columns to read (database names); default all but
+            the meaningless level_1
+        file, string: path of the database
+    """
+    key = (os.path.abspath(file), constit_set, yr_end, None if columns is None else tuple(columns))
+    mtime = os.path.getmtime(file)
+    if key in _memo and _memo[key][0] == mtime:
+        return _memo[key][1].copy()
+
+    # Read-only connection
+    uri = pathlib.Path(file).resolve().as_uri() + '?mode=ro'
+    cnxn = sq.connect(uri, uri = True)
+
+    types = {row[1]: row[2] for row in cnxn.execute("PRAGMA table_info('const_yr')")}
+    if columns is None:
+        columns = [c for c in types if c != 'level_1']
 
     sql = (
-        "SELECT * "
+        f"SELECT {', '.join(f'[{c}]' for c in columns)} "
         "FROM 'const_yr' "
-        "WHERE naam IN ('Delfzijl', 'Harlingen', "
-        "'Den Helder', 'IJmuiden',  "
-        "'Hoek van Holland', 'Vlissingen') "
-        "AND (count) "
+        "WHERE const_set = ? "
+        f"AND naam IN ({', '.join('?' * len(names))}) "
+        "AND year <= ? "
+        "AND count > 0"
     )
-    df = pd.read_sql(sql, cnxn)
+    df = pd.read_sql(sql, cnxn, params = [constit_set, *names, yr_end])
     cnxn.close()
 
-    df.columns = df.columns.str.replace('_ampl', '')
+    # Constituents not in the set are NULL throughout; keep them numeric
+    real = [c for c in columns if types[c] == 'REAL']
+    df[real] = df[real].astype(float)
 
-    df = df[df['const_set'] == constit_set]
+    df.columns = df.columns.str.replace('_ampl', '')
 
-    df = df[df['year'] < 2022]
+    if 'M2' in df.columns and 'S2' in df.columns:
+        df['M2+S2'] = df['M2'] + df['S2']
 
-    df['M2+S2'] = df['M2'] + df['S2']
-    return df
+    _memo[key] = (mtime, df)
+    return df.copy()
 
 
 def read_data_psmsl():
@@ -80,9 +125,7 @@ def read_data_ipcc():
     Read specified data IPCC
     """
     # Connect database
-    path = r'./Data'
-    conn_str = os.path.join(path, 'IPCC.db')
-    cnxn = sq.connect(conn_str, detect_types = True)
+    cnxn = sq.connect(IPCC_DB, detect_types = True)
     sql = (
         "SELECT * "
         "FROM data "
@@ -107,7 +150,7 @@ def process_ipcc(df):
     # Put name as first column
     cols = df.columns.tolist()
     cols = cols[-1:] + cols[:-1]
-    df = cp.deepcopy(df[cols])
+    df = df[cols].copy()
 
     # add parameters
     df['90%_band'] = df['90%_high'] - df['median']
@@ -123,13 +166,158 @@ def process_ipcc(df):
     return df
 
 
+def read_ipcc_cube(process = 'totalrates', file = IPCC_DB):
+    """
+    IPCC projections of the stations as an indexed array, read in a single
+    query for all scenarios, confidence levels and years. Kept in memory
+    until the database file changes.
+
+    Args:
+        process, string: projected quantity
+        file, string: path of the database
+
+    Returns:
+        dict with the index lists name (spelling of constants.names),
+        scenario, confidence, year and stat, and values, array (name,
+        scenario, confidence, year, stat) in the units of the database;
+        NaN where no projection is given
+    """
+    key = ('ipcc', os.path.abspath(file), process)
+    mtime = os.path.getmtime(file)
+    if key not in _memo or _memo[key][0] != mtime:
+        uri = pathlib.Path(file).resolve().as_uri() + '?mode=ro'
+        cnxn = sq.connect(uri, uri = True)
+        available = [row[1] for row in cnxn.execute("PRAGMA table_info('data')")]
+        stats = [c for c in IPCC_STATS if c in available]
+
+        sql = (
+            f"SELECT name, scenario, confidence, year, {', '.join(f'[{c}]' for c in stats)} "
+            "FROM data "
+            "WHERE process = ? "
+            f"AND name IN ({', '.join('?' * len(names))})"
+        )
+        df = pd.read_sql(sql, cnxn, params = [process, *[nm.upper() for nm in names]])
+        cnxn.close()
+
+        if 'sigma' not in stats:
+            df['sigma'] = (df['90%_high'] - df['90%_low']) / (2 * stat.norm.ppf(0.95))
+
+        cube = {
+            'name': [nm for nm in names if nm.upper() in set(df['name'])],
+            'scenario': sorted(df['scenario'].unique()),
+            'confidence': sorted(df['confidence'].unique()),
+            'year': sorted(df['year'].unique()),
+            'stat': IPCC_STATS}
+        idx = tuple(
+            np.searchsorted(np.array(cube[dim], dtype = object), df[dim].to_numpy())
+            for dim in ['scenario', 'confidence', 'year'])
+        station = {nm.upper(): i for i, nm in enumerate(cube['name'])}
+
+        values = np.full([len(cube[dim]) for dim in CUBE_DIMS], np.nan)
+        values[(df['name'].map(station).to_numpy(), ) + idx] = df[IPCC_STATS].to_numpy(dtype = float)
+        cube['values'] = values
+        _memo[key] = (mtime, cube)
+
+    cube = _memo[key][1]
+    return {**cube, 'values': cube['values'].copy()}
+
+
+def select(cube, **labels):
+    """
+    Part of a cube, e.g. select(cube, scenario = ['ssp245'], stat = ['median'])
+
+    Args:
+        cube, dict: see read_ipcc_cube
+        labels, lists: labels to keep per dimension
+    """
+    res = dict(cube)
+    values = cube['values']
+    for ax, dim in enumerate(CUBE_DIMS):
+        if dim in labels:
+            pos = [cube[dim].index(lb) for lb in labels[dim]]
+            values = np.take(values, pos, axis = ax)
+            res[dim] = list(labels[dim])
+    res['values'] = values
+    return res
+
+
+def cube_frame(cube):
+    """
+    Cube as a table with a row per name, scenario, confidence and year and a
+    column per statistic; combinations without projection are left out
+    """
+    index = pd.MultiIndex.from_product([cube[dim] for dim in CUBE_DIMS[:-1]], names = CUBE_DIMS[:-1])
+    df = pd.DataFrame(cube['values'].reshape(len(index), -1), index = index, columns = cube['stat'])
+    return df.dropna(how = 'all').reset_index()
+
+
+def ztest_ipcc(cube, obs, alpha = 0.05, scale = IPCC_SCALE):
+    """
+    Two-sided Z-tests of the observed rates against the IPCC median rates,
+    for all scenarios, confidence levels and years of the cube at once
+
+    Args:
+        cube, dict: see read_ipcc_cube
+        obs, dataframe: name, mean_obs and sigma_obs per station, in the
+            units of the parameter tables (mm/century)
+        alpha, float: significance level
+        scale, float: factor from the units of the cube to those of obs
+
+    Returns:
+        dataframe per name, scenario, confidence and year with mean_ipcc,
+        sigma_ipcc, mean_obs, sigma_obs, Z, p-value and reject
+    """
+    obs = obs.set_index(obs['name'].str.upper()).reindex([nm.upper() for nm in cube['name']])
+    shape = (-1, 1, 1, 1)
+    mean_obs = obs['mean_obs'].to_numpy(dtype = float).reshape(shape)
+    sigma_obs = obs['sigma_obs'].to_numpy(dtype = float).reshape(shape)
+
+    mean_ipcc = scale * cube['values'][..., cube['stat'].index('median')]
+    sigma_ipcc = scale * cube['values'][..., cube['stat'].index('sigma')]
+
+    Z = (mean_ipcc - mean_obs) / np.sqrt(sigma_ipcc**2 + sigma_obs**2)
+    pval = 2 * stat.norm.sf(np.abs(Z))
+
+    index = pd.MultiIndex.from_product([cube[dim] for dim in CUBE_DIMS[:-1]], names = CUBE_DIMS[:-1])
+    res = pd.DataFrame({
+        'mean_ipcc': mean_ipcc.ravel(),
+        'sigma_ipcc': sigma_ipcc.ravel(),
+        'mean_obs': np.broadcast_to(mean_obs, Z.shape).ravel(),
+        'sigma_obs': np.broadcast_to(sigma_obs, Z.shape).ravel(),
+        'Z': Z.ravel(),
+        'p-value': pval.ravel(),
+        'reject': (pval < alpha).ravel()}, index = index)
+    return res.dropna(subset = ['mean_ipcc']).reset_index()
+
+
+def _pyplot():
+    """
+    matplotlib.pyplot with the settings of the project; imported on first
+    use, so data-only users of this module do not load matplotlib
+    """
+    import matplotlib.pyplot as plt
+    plt.rcParams['axes.grid'] = True
+    return plt
+
+
+def _stations(df, column = 'naam'):
+    """
+    Rows per station, grouped once; stations without data get an empty frame
+    """
+    groups = dict(tuple(df.groupby(column)))
+    empty = df.iloc[:0]
+    return lambda nm: groups.get(nm, empty)
+
+
 def graph_Rsqadj(df):
     """
     Graph of coefficients of determination of harmonic analysis
     """
+    plt = _pyplot()
+    station = _stations(df)
     fig, ax = plt.subplots(nrows = 6, ncols = 1, sharex = True, sharey = True, figsize = figsize)
     for i, nm in enumerate(names):
-        data = df[df['naam'] == nm]
+        data = station(nm)
         ax[i].plot(
             data['year'], data['Rsq_adj'], 'rx'
         )
@@ -149,9 +337,14 @@ def graph_z0(df, psmsl):
     """
     Graph mean sea level
     """
+    plt = _pyplot()
+    station = _stations(df)
+    gauge = _stations(psmsl, 'name')
     _, ax = plt.subplots(nrows = 6, ncols = 1, sharex = True, sharey = True, figsize = figsize)
     for i, nm in enumerate(names):
-        data = df[np.logical_and(df['naam'] == nm, df['count'] < Nmn)]
+        full = station(nm)
+        low = full['count'] < Nmn
+        data = full[low]
 
         ax[i].set_ylim([-0.5, 0.5])
         
@@ -165,7 +358,7 @@ def graph_z0(df, psmsl):
             label = 'Arithmetic mean sea level. N < ' + str(Nmn) + ' points per year',
             markersize = 8, mfc = 'none')
 
-        data = df[np.logical_and(df['naam'] == nm, df['count'] >= Nmn)]
+        data = full[~low]
 
         ax[i].plot(
             data['year'], data['z0'], 'ro',
@@ -179,7 +372,7 @@ def graph_z0(df, psmsl):
 
 
         mn = data[data['year']>=1990]['zmean'].mean()
-        data = psmsl[psmsl['name'] == nm.upper()]
+        data = gauge(nm.upper())
 
         mn2 = data[data['time']>=1990]['level'].mean()
         delta = mn2 - mn
@@ -202,35 +395,36 @@ def graph_amplitudes(df):
     """
     Graph of tidal amplitude; summed M2 and S2
     """
+    plt = _pyplot()
+    station = _stations(df)
     _, ax = plt.subplots(nrows = 6, ncols = 1, sharex = True, sharey = False, figsize = figsize)
     for i, nm in enumerate(names):
-        data = df[df['naam'] == nm]
+        full = station(nm)
+        low = full['count'] < Nmn
         
-        mu = (data['M2'] + data['S2']).mean()
+        mu = (full['M2'] + full['S2']).mean()
 
-        data = data[df['count'] < Nmn]
+        data = full[low]
 
         ax[i].plot(
             data['year'], data['M2+S2'], 'rs',
             label = 'Summed amplitude M2 and S2, N < '+ str(Nmn),
             markersize = 8, mfc = 'none')
 
-        data = df[np.logical_and(df['naam'] == nm, df['count'] >= Nmn)]
+        data = full[~low]
 
         ax[i].plot(
             data['year'], data['M2+S2'], 'rs',
             label = 'Summed amplitude M2 and S2, N >= '+ str(Nmn),
             markersize = 8)
 
-        data = df[df['naam'] == nm]
-        
         ax[i].plot(
-            data['year'], data['M2'], 'kx',
+            full['year'], full['M2'], 'kx',
             label = 'Amplitude of M2'
         )
 
         ax[i].plot(
-            data['year'], data['S2'], 'b^',
+            full['year'], full['S2'], 'b^',
             label = 'Amplitude of S2'
         )
 
@@ -254,28 +448,29 @@ def graph_windeffect(df):
     """
     Graph of calculated wind effect
     """
+    plt = _pyplot()
+    station = _stations(df)
     _, ax = plt.subplots(nrows = 6, ncols = 1, sharex = True, sharey = False, figsize = figsize)
     for i, nm in enumerate(names):
-        data = df[df['naam'] == nm]
+        full = station(nm)
+        low = full['count'] < Nmn
         
-        mu = (data['smean']).mean()
+        mu = (full['smean']).mean()
 
-        data = data[df['count'] < Nmn]
+        data = full[low]
 
         ax[i].plot(
             data['year'], data['smean'], 'rs',
             label = 'Yearly mean wind effect, N < '+ str(Nmn),
             markersize = 8, mfc = 'none')
 
-        data = df[np.logical_and(df['naam'] == nm, df['count'] >= Nmn)]
+        data = full[~low]
 
         ax[i].plot(
             data['year'], data['smean'], 'rs',
             label = 'Yearly mean wind effect, N >= '+ str(Nmn),
             markersize = 8)
 
-        data = df[df['naam'] == nm]
-        
         ax[i].set_ylabel('Difference with tide (m)')
         ax[i].set_xlabel('Year')
 
@@ -292,4 +487,4 @@ def graph_windeffect(df):
 if __name__ == '__main__':
     df = read_data_rws(constit_set = 'Ftested3')
     graph_amplitudes(df)
-    plt.show()
+    _pyplot().show()